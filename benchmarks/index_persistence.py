@@ -0,0 +1,19 @@
+"""Compare loading a saved Interpolator index with building it from scratch."""
+import shutil
+import tempfile
+from timeit import Timer
+
+import numpy as np
+
+setup_base = "import numpy as np; from smear.interpolate import Interpolator; \
+np.random.seed(0); points = np.random.random((%r,2)); values = np.random.random(%r); path = %r"
+
+for n in 10**np.arange(4, 7):
+    path = tempfile.mkdtemp()
+    setup = setup_base % (n, n, path)
+    Timer("fn = Interpolator(points, values); fn.triangulation; fn.save(path)", setup).timeit(1)
+
+    build = min(Timer("Interpolator(points, values).triangulation", setup).repeat(3, 1))
+    load = min(Timer("Interpolator.load(path)", setup).repeat(3, 1))
+    print("%9d points: build %8.4fs  load %8.4fs  (%.0fx)" % (n, build, load, build / load))
+    shutil.rmtree(path)
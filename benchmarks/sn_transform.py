@@ -0,0 +1,45 @@
+"""Compare the batched SN_CoordinateSystem transforms with the point by point shapely transforms."""
+from timeit import Timer
+
+import numpy as np
+from shapely.geometry import Point
+
+from smear.transform import SN_CoordinateSystem
+
+
+def transform_xy_to_sn_shapely(coordinate_system, x, y):
+    centerline = coordinate_system.centerline
+    d = coordinate_system.slope_distance
+    s = np.zeros(x.size)
+    n = np.zeros(x.size)
+    for ii in range(x.size):
+        pt = Point((x[ii], y[ii]))
+        s[ii] = centerline.project(pt)
+        pt_s = centerline.interpolate(s[ii])
+        pt_s1 = centerline.interpolate(max(s[ii] - d, 0))
+        pt_s2 = centerline.interpolate(s[ii] + d)
+        cross = (pt_s2.x - pt_s1.x) * (pt.y - pt_s.y) - (pt_s2.y - pt_s1.y) * (pt.x - pt_s.x)
+        n[ii] = -np.sign(cross) * pt_s.distance(pt)
+    return s, n
+
+
+# a meandering river 18km long surveyed up to 50m either side of the centerline
+np.random.seed(0)
+t = np.linspace(0, 40 * np.pi, 1000)
+coordinate_system = SN_CoordinateSystem(100 * t, 150 * np.sin(t))
+
+for size in 10**np.arange(3, 7):
+    x, y = coordinate_system.transform_sn_to_xy(np.random.random(size) * coordinate_system.centerline.length,
+                                                np.random.random(size) * 100 - 50)
+    s, n = coordinate_system.transform_xy_to_sn(x, y)
+
+    # small sizes run in about a millisecond, time enough calls to measure them
+    number = max(1, 10**5 // size)
+    batched = min(Timer(lambda: coordinate_system.transform_xy_to_sn(x, y)).repeat(3, number)) / number
+    inverse = min(Timer(lambda: coordinate_system.transform_sn_to_xy(s, n)).repeat(3, number)) / number
+    # the point by point transform takes linear time, extrapolate it for large sizes
+    sample = min(size, 10**4)
+    shapely = Timer(lambda: transform_xy_to_sn_shapely(coordinate_system, x[:sample], y[:sample])).timeit(1)
+    shapely *= size / sample
+    print("%9d points: shapely %9.3fs  batched %8.4fs  (%.0fx)  inverse %8.4fs" % (size, shapely, batched,
+                                                                               shapely / batched, inverse))
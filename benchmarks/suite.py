@@ -0,0 +1,203 @@
+"""Benchmark suite covering the interpolation methods, gridding, track cleaning, thiessen polygons and the SN transforms.
+
+Every case is timed (best of ``--repeat`` runs) and its peak memory is
+measured in a separate run with tracemalloc, which sees the numpy arrays but
+not the memory allocated inside scipy's C++ code (e.g. the KD-tree nodes).
+Building an index is timed separately from querying it. The results are
+written as JSON, and compared with a baseline file when one is given: the
+run fails (exit status 1) if any case is slower than ``--threshold`` times
+its baseline time.
+
+    PYTHONPATH=. python benchmarks/suite.py --quick --output baseline.json
+    PYTHONPATH=. python benchmarks/suite.py --quick --baseline baseline.json --threshold 1.5
+"""
+import argparse
+from functools import lru_cache
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+from scipy.interpolate import griddata
+
+from smear import Interpolator, grid, densify_path, interpolate_duplicated_gps, thiessen, SN_CoordinateSystem
+
+SIZES = {
+    'quick': {'sources': [10**3, 10**4], 'targets': [10**3, 10**4], 'nnear': [6, 16], 'local': 10**2},
+    'full': {'sources': [10**4, 10**5, 10**6], 'targets': [10**4, 10**5, 10**6], 'nnear': [6, 16, 32],
+             'local': 10**3},
+}
+
+
+def cases(sizes, workers):
+    """yields ``(name, setup, run)`` for every benchmark, ``run(setup())``
+    is the timed statement"""
+    rng = np.random.default_rng(0)
+    largest = max(sizes['targets'])
+
+    for n in sizes['sources']:
+        points = rng.random((n, 2)) * 100
+        values = rng.random(n)
+        yield ('build/tree n=%d' % n, lambda: None, lambda state, p=points, v=values: Interpolator(p, v))
+        yield ('build/triangulation n=%d' % n, lambda p=points, v=values: Interpolator(p, v), _build_triangulation)
+
+    # queries scale over the number of sources (with the largest target size) and targets (with the median sources)
+    middle = sizes['sources'][len(sizes['sources']) // 2]
+    shapes = [(n, largest) for n in sizes['sources']] + [(middle, m) for m in sizes['targets'] if m != largest]
+    for n, m in shapes:
+        points = rng.random((n, 2)) * 100
+        values = rng.random(n)
+        xi = rng.random((m, 2)) * 100
+        # the interpolator is shared by all the queries of this size
+        setup = lru_cache(maxsize=None)(lambda p=points, v=values: _warm_interpolator(p, v))
+        for method in ('nearest', 'linear', 'cubic', 'natural'):
+            yield ('query/%s n=%d m=%d' % (method, n, m), setup, lambda fn, x=xi, k=method: fn(x, method=k))
+        yield ('query/kriging n=%d m=%d nnear=12' % (n, m), setup,
+               lambda fn, x=xi: fn(x, method='kriging', nnear=12))
+        for nnear in sizes['nnear']:
+            yield ('query/idw n=%d m=%d nnear=%d' % (n, m, nnear), setup,
+                   lambda fn, x=xi, k=nnear: fn(x, method='idw', nnear=k))
+        yield ('scipy/griddata linear n=%d m=%d' % (n, m), lambda: None,
+               lambda state, p=points, v=values, x=xi: griddata(p, v, x, method='linear'))
+
+    # the local triangulation is per target, keep it small
+    n, m = middle, sizes['local']
+    points = rng.random((n, 2)) * 100
+    values = rng.random(n)
+    xi = rng.random((m, 2)) * 100
+    for method in ('linear', 'cubic'):
+        yield ('query/%s local n=%d m=%d nnear=10' % (method, n, m), lambda p=points, v=values: Interpolator(p, v),
+               lambda fn, x=xi, k=method: fn(x, method=k, nnear=10, triangulation='local'))
+
+    # gridding scales over the number of cores
+    side = int(np.sqrt(largest))
+    x = y = np.linspace(0, 100, side)
+    points = rng.random((middle, 2)) * 100
+    values = rng.random(middle)
+    for w in sorted({1, workers}):
+        for method in ('idw', 'linear'):
+            yield ('grid/%s n=%d cells=%d workers=%d' % (method, middle, side**2, w),
+                   lambda p=points, v=values: _warm_interpolator(p, v),
+                   lambda fn, k=method, w=w, x=x, y=y: grid(fn, x, y, method=k, workers=w))
+
+    for n in sizes['sources']:
+        points = rng.random((n, 2)) * 100
+        yield ('thiessen n=%d' % n, lambda: None, lambda state, p=points: thiessen(p, flat=True))
+
+        track = _gps_track(rng, n)
+        yield ('path/densify_path n=%d' % n, lambda: None, lambda state, t=track: densify_path(t, 0.5))
+        yield ('path/interpolate_duplicated_gps n=%d' % n, lambda: None,
+               lambda state, t=track: interpolate_duplicated_gps(t))
+
+    # a meandering river 18km long surveyed up to 50m either side of the centerline
+    t = np.linspace(0, 40 * np.pi, 1000)
+    coordinate_system = SN_CoordinateSystem(100 * t, 150 * np.sin(t))
+    for m in sizes['targets']:
+        s = rng.random(m) * coordinate_system.centerline.length
+        n = rng.random(m) * 100 - 50
+        xs, ys = coordinate_system.transform_sn_to_xy(s, n)
+        for w in sorted({1, workers}):
+            yield ('sn/xy_to_sn m=%d workers=%d' % (m, w), lambda: coordinate_system,
+                   lambda cs, x=xs, y=ys, w=w: cs.transform_xy_to_sn(x, y, workers=w))
+        yield ('sn/sn_to_xy m=%d' % m, lambda: coordinate_system,
+               lambda cs, s=s, n=n: cs.transform_sn_to_xy(s, n))
+
+
+def measure(setup, run, repeat):
+    """returns the best time of ``repeat`` runs and the peak traced memory
+    of one more run, in bytes"""
+    state = setup()
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(state)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+def compare(results, baseline, threshold):
+    """returns the ``(name, seconds, baseline seconds)`` of the cases that
+    are more than ``threshold`` times slower than in ``baseline``"""
+    previous = dict((case['name'], case['seconds']) for case in baseline['cases'])
+    return [(case['name'], case['seconds'], previous[case['name']]) for case in results['cases']
+            if case['name'] in previous and case['seconds'] > threshold * previous[case['name']]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='small sizes only')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of every case')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='largest number of cores')
+    parser.add_argument('--filter', default='', help='only run the cases whose name contains this')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.5, help='allowed slowdown relative to the baseline')
+    args = parser.parse_args(argv)
+
+    sizes = SIZES['quick' if args.quick else 'full']
+    results = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+                    'scipy': scipy.__version__, 'cpu_count': os.cpu_count()},
+        'sizes': 'quick' if args.quick else 'full',
+        'cases': [],
+    }
+    for name, setup, run in cases(sizes, args.workers):
+        if args.filter not in name:
+            continue
+        seconds, peak = measure(setup, run, args.repeat)
+        results['cases'].append({'name': name, 'seconds': seconds, 'peak_bytes': peak})
+        print("%-60s %10.4fs %10.1fMB" % (name, seconds, peak / 2**20))
+        sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, seconds, previous in regressions:
+            print("REGRESSION %-49s %10.4fs (baseline %.4fs, %.2fx)" % (name, seconds, previous, seconds / previous))
+        if regressions:
+            return 1
+
+    return 0
+
+
+def _build_triangulation(fn):
+    fn._index._triangulation = None
+    fn.triangulation
+
+
+def _warm_interpolator(points, values):
+    """returns an Interpolator with the triangulation and the structures
+    built on it already cached, so that only the queries are timed"""
+    fn = Interpolator(points, values)
+    fn.triangulation
+    fn._index.cubic_interpolator
+    fn._index.circumcircles
+    fn.variogram
+    return fn
+
+
+def _gps_track(rng, n):
+    """a random walk of ``n`` fixes where every fix is repeated a few times,
+    as recorded by an echo sounder pinging faster than its gps updates"""
+    fixes = np.cumsum(rng.random((n // 4 + 1, 2)), axis=0)
+    return np.repeat(fixes, 4, axis=0)[:n]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
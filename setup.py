@@ -39,7 +39,7 @@ setup(
         'pyproj',
         'requests',
         'scipy>=0.9',
-        'shapely',
+        'shapely>=2.0',
     ],
     classifiers=[
         'Development Status :: 3 - Alpha',
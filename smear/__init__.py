@@ -1,4 +1,8 @@
 from .interpolate import Interpolator
-from .path import densify_path, interpolate_duplicated_gps
+from .grid import grid, dirty_tiles
+from .path import densify_path, interpolate_duplicated_gps, densify_path_chunks, interpolate_duplicated_gps_chunks, \
+    clean_track_chunks
 from .transform import projection, retrieve_projection_params, SN_CoordinateSystem
-from .thiessen import thiessen
\ No newline at end of file
+from .thiessen import thiessen, clip_thiessen, thiessen_areas
+from .instrument import Profile, add_hook, remove_hook
+from .kriging import Variogram, fit_variogram
@@ -0,0 +1,73 @@
+"""
+module with a memory bounded least recently used cache for interpolation weights
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+
+import numpy as np
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'nbytes', 'maxbytes'])
+
+
+class LRUCache:
+    """Least recently used cache of tuples of numpy arrays, holding at most
+    ``maxbytes`` bytes of arrays. Entries larger than ``maxbytes`` are not
+    stored. Safe to use from several threads.
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # caches are not shared with copies (e.g. in worker processes)
+        return {'maxbytes': self.maxbytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxbytes'])
+
+    def get(self, key):
+        """returns the cached arrays for ``key`` or None"""
+        with self._lock:
+            arrays = self._entries.get(key)
+            if arrays is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return arrays
+
+    def put(self, key, arrays):
+        nbytes = sum(a.nbytes for a in arrays if a is not None)
+        if nbytes > self.maxbytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = arrays
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes:
+                key, evicted = self._entries.popitem(last=False)
+                self.nbytes -= sum(a.nbytes for a in evicted if a is not None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, len(self._entries), self.nbytes, self.maxbytes)
+
+
+def array_key(xi, *params):
+    """returns a hashable key for the array ``xi`` and the query parameters"""
+    xi = np.ascontiguousarray(xi)
+    digest = hashlib.sha1(xi.view(np.uint8)).hexdigest()
+    return (digest, xi.shape, xi.dtype.str) + params
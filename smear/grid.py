@@ -0,0 +1,316 @@
+"""
+module for gridding scatter data onto regular rasters in tiles, optionally in parallel
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree as KDTree
+
+from .instrument import stage
+from .interpolate import Interpolator
+from .transform import reproject
+
+
+def grid(interpolator, x, y, method='nearest', tile_size=256, workers=1, executor='thread',
+         out=None, crs=None, **kwargs):
+    """Interpolate onto the regular grid defined by the 1d coordinate arrays
+    ``x`` and ``y``.
+
+    The output grid is split into square tiles of ``tile_size`` cells which
+    are interpolated independently and written into a single output array
+    of shape ``(len(y), len(x)) + values.shape[1:]``. Every tile gives
+    exactly the same result as interpolating the full grid at once, so the
+    stitched output has no seams.
+
+    Parameters
+    ----------
+    interpolator: Interpolator
+        interpolator holding the scatter points and values
+
+    x, y: numpy arrays
+        coordinates of the grid columns and rows
+
+    method: string
+        any method accepted by ``Interpolator.__call__``
+
+    tile_size: integer
+        number of grid cells along each side of a tile
+
+    workers: integer
+        number of tiles interpolated concurrently, -1 uses all cores
+
+    executor: string
+        'thread' interpolates tiles in a thread pool sharing the
+        interpolator (cKDTree queries and the triangulation lookups release
+        the GIL). 'process' uses a process pool; for the nearest neighbour
+        based methods each tile is sent only the points within its tile plus
+        a halo wide enough to contain the neighbours of every cell. For the
+        global triangulation, which natural neighbour interpolation uses as
+        well, and for channel aligned anisotropy, where no halo can be
+        bounded, the interpolator is sent once to each worker instead.
+
+    out: numpy array, optional
+        array (e.g. a ``numpy.memmap``) to write the output into. When the
+        interpolator has named channels the output is returned as a dict of
+        2d views into this array.
+
+    crs: optional
+        coordinate reference system of ``x`` and ``y`` when it differs from
+        the crs of the interpolator. The cells of each tile are reprojected
+        into the crs of the interpolator as the tile is interpolated, so
+        the full grid of coordinates is never built.
+
+    With ``max_distance`` (see ``Interpolator.__call__``) whole tiles with
+    no point within ``max_distance`` of any of their cells are filled with
+    NaN up front, so the empty parts of a grid around a sparse survey cost
+    nothing.
+
+    kwargs:
+        passed on to ``Interpolator.__call__``
+    """
+    if executor not in ('thread', 'process'):
+        raise ValueError("Unknown executor %s, expected 'thread' or 'process'." % (executor))
+    if crs is not None and interpolator.crs is None:
+        raise ValueError("A grid in crs %s needs an Interpolator with a crs" % (crs,))
+    if kwargs.get('return_variance'):
+        raise ValueError("grid does not return the kriging variance, interpolate the cells directly instead")
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = (len(y), len(x)) + np.shape(interpolator.values[0])
+    if out is None:
+        out = np.empty(shape, dtype=interpolator._index.dtype)
+    elif out.shape != shape:
+        raise ValueError("Found out array with shape %s. Expected shape %s" % (str(out.shape), str(shape)))
+
+    if workers == -1:
+        workers = os.cpu_count()
+
+    tiles = _tiles(out.shape[:2], tile_size)
+    if kwargs.get('max_distance') is not None:
+        # tiles without any point within max_distance are NaN without being sent to a worker
+        empty = _empty_tiles(interpolator, x, y, tiles, kwargs['max_distance'], crs)
+        for rows, cols in [tile for tile, is_empty in zip(tiles, empty) if is_empty]:
+            out[rows, cols] = np.nan
+        tiles = [tile for tile, is_empty in zip(tiles, empty) if not is_empty]
+    kwargs['method'] = method
+    if method == 'kriging' and kwargs.get('variogram') is None:
+        # fit once, so that every tile (and the halo subsets sent to processes) uses the same variogram
+        kwargs['variogram'] = interpolator.variogram
+    global_triangulation = (method == 'natural' or
+                            method in ('linear', 'cubic') and kwargs.get('triangulation', 'global') == 'global')
+
+    if workers == 1:
+        for rows, cols in tiles:
+            out[rows, cols] = _interpolate_tile(interpolator, x[cols], y[rows], crs, kwargs)
+
+    elif executor == 'thread':
+        # build the shared triangulation up front rather than racing to build it in every thread
+        if global_triangulation:
+            interpolator.triangulation
+            if method == 'cubic':
+                interpolator._index.cubic_interpolator
+            elif method == 'natural':
+                interpolator._index.circumcircles
+
+        with ThreadPoolExecutor(workers) as pool:
+            _run_tiles(pool, ((rows, cols, _interpolate_tile, (interpolator, x[cols], y[rows], crs, kwargs))
+                              for rows, cols in tiles), out, 2 * workers)
+
+    elif global_triangulation or interpolator._metric.lipschitz is None:
+        with ProcessPoolExecutor(workers, initializer=_set_worker_interpolator,
+                                 initargs=(interpolator,)) as pool:
+            _run_tiles(pool, ((rows, cols, _interpolate_tile, (None, x[cols], y[rows], crs, kwargs))
+                              for rows, cols in tiles), out, 2 * workers)
+
+    else:
+        nnear = 1 if method == 'nearest' else kwargs.get('nnear', 6)
+        interpolator.compact()
+        with ProcessPoolExecutor(workers) as pool:
+            _run_tiles(pool, ((rows, cols, _interpolate_halo_tile, _halo_tile_args(interpolator, x[cols], y[rows],
+                                                                                  nnear, crs, kwargs))
+                              for rows, cols in tiles), out, 2 * workers)
+
+    if hasattr(out, 'flush'):
+        out.flush()
+
+    if interpolator.channels is not None:
+        return dict((name, out[..., n]) for n, name in enumerate(interpolator.channels))
+
+    return out
+
+
+def dirty_tiles(interpolator, x, y, tile_size=256, nnear=6, crs=None):
+    """Return the ``(rows, cols)`` slices of the tiles of the grid spanned
+    by ``x`` and ``y`` whose cells may have changed because points were
+    added to or removed from ``interpolator`` since the last call.
+
+    A cell can only change if a changed point is (or was) one of its
+    ``nnear`` nearest neighbours, so a tile is dirty when a changed point
+    lies within its halo (see ``grid``). This is exact for the nearest
+    neighbour based methods, for the global triangulation pass an ``nnear``
+    large enough to cover the triangles around a changed point. ``crs``
+    is the crs of ``x`` and ``y`` as for ``grid``.
+    """
+    changed = interpolator.pop_dirty_points()
+    if not len(changed):
+        return []
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    changed = KDTree(interpolator._metric(changed))
+    tiles = []
+    for rows, cols in _tiles((len(y), len(x)), tile_size):
+        center, radius = _tile_halo(interpolator, x[cols], y[rows], nnear, crs)
+        if not np.isfinite(radius) or changed.query_ball_point(center, radius, return_length=True):
+            tiles.append((rows, cols))
+
+    return tiles
+
+
+#---------------------------------------------------------------------------
+# internal functions
+#---------------------------------------------------------------------------
+_worker_interpolator = None
+
+
+def _set_worker_interpolator(interpolator):
+    """process pool initializer storing the interpolator shared by all tiles"""
+    global _worker_interpolator
+    _worker_interpolator = interpolator
+
+
+def _run_tiles(pool, tasks, out, max_pending):
+    """submit the ``(rows, cols, fn, args)`` tasks to ``pool`` and write each
+    result into ``out[rows, cols]``. At most ``max_pending`` tiles are in
+    flight at once, so memory use is bounded by the tile size and not by the
+    size of the grid.
+    """
+    pending = deque()
+    for rows, cols, fn, args in tasks:
+        pending.append((rows, cols, pool.submit(fn, *args)))
+        if len(pending) >= max_pending:
+            rows, cols, future = pending.popleft()
+            out[rows, cols] = future.result()
+
+    while pending:
+        rows, cols, future = pending.popleft()
+        out[rows, cols] = future.result()
+
+
+def _interpolate_tile(interpolator, x, y, crs, kwargs):
+    """interpolate the grid cells of a single tile, returns an array of
+    shape (len(y), len(x)) + values.shape[1:]
+    """
+    if interpolator is None:
+        interpolator = _worker_interpolator
+
+    with stage('grid.tile', len(x) * len(y)) as s:
+        xx, yy = np.meshgrid(x, y)
+        xi = np.vstack((xx.ravel(), yy.ravel())).T
+        if crs is not None:
+            reproject(xi, crs, interpolator.crs, out=xi)
+        values = interpolator._interpolate(xi, **kwargs)
+        s.nbytes = values.nbytes
+    return values.reshape((len(y), len(x)) + values.shape[1:])
+
+
+def _interpolate_halo_tile(points, values, ellipsivity, anisotropy, interpolator_crs, leafsize, precision,
+                           x, y, crs, kwargs):
+    """interpolate a single tile from the subset of points in its halo"""
+    return _interpolate_tile(Interpolator(points, values, ellipsivity=ellipsivity, anisotropy=anisotropy,
+                                          crs=interpolator_crs, leafsize=leafsize, precision=precision),
+                             x, y, crs, kwargs)
+
+
+def _halo_tile_args(interpolator, x, y, nnear, crs, kwargs):
+    """returns the arguments of ``_interpolate_halo_tile`` for one tile"""
+    ix = _tile_halo_indices(interpolator, x, y, nnear, crs)
+    if kwargs.get('weights') is not None:
+        # the point weights refer to the points, subset them the same way
+        kwargs = dict(kwargs, weights=np.asarray(kwargs['weights'])[ix])
+    return (interpolator.points[ix], interpolator.values[ix], interpolator.ellipsivity, interpolator.anisotropy,
+            interpolator.crs, interpolator.leafsize, interpolator.precision, x, y, crs, kwargs)
+
+
+def _tiles(shape, tile_size):
+    """returns a list of (row slice, column slice) tuples covering an
+    array of the given 2d shape"""
+    return [(slice(r, r + tile_size), slice(c, c + tile_size))
+            for r in range(0, shape[0], tile_size)
+            for c in range(0, shape[1], tile_size)]
+
+
+def _tile_halo(interpolator, x, y, nnear, crs=None):
+    """returns the center and radius, both in the search space of the
+    interpolator, of a circle containing the ``nnear`` nearest neighbours of
+    every cell in the tile spanned by ``x`` and ``y``.
+
+    The distance to the kth nearest neighbour changes by at most the
+    distance moved, so for any cell it is bounded by the kth neighbour
+    distance at a tile corner plus the tile diagonal. All points within that
+    halo of the tile lie inside a circle around the tile center. Distances
+    in the search space grow by at most the Lipschitz constant of the
+    metric; the radius is infinite when that is unbounded.
+
+    A tile given in another ``crs`` is replaced by its bounding box in the
+    crs of the interpolator (see ``_tile_bounds``).
+    """
+    metric = interpolator._metric
+    x, y = _tile_bounds(interpolator, x, y, crs)
+    corners = np.array([[x[0], y[0]], [x[0], y[-1]], [x[-1], y[0]], [x[-1], y[-1]]])
+    center = metric(corners.mean(axis=0)[np.newaxis])[0]
+    if metric.lipschitz is None:
+        return center, np.inf
+
+    diagonal = np.hypot(x[-1] - x[0], y[-1] - y[0]) * metric.lipschitz
+    dist, ix = interpolator._index.query(corners, k=nnear)
+    halo = np.min(dist[:, -1]) + diagonal
+
+    return center, diagonal / 2 + halo
+
+
+def _empty_tiles(interpolator, x, y, tiles, max_distance, crs=None):
+    """returns a boolean array marking the tiles that have no point within
+    ``max_distance`` (in the search space) of any of their cells, found
+    with a single bounded query of all the tile centers. Tiles given in
+    another ``crs`` are replaced by their bounding boxes as in ``_tile_halo``."""
+    metric = interpolator._metric
+    if metric.lipschitz is None or not len(tiles):
+        return np.zeros(len(tiles), dtype=bool)
+
+    bounds = [_tile_bounds(interpolator, x[cols], y[rows], crs) for rows, cols in tiles]
+    corners = np.array([[tile_x[0], tile_y[0], tile_x[-1], tile_y[-1]] for tile_x, tile_y in bounds])
+    centers = (corners[:, :2] + corners[:, 2:]) / 2
+    radius = np.hypot(*(corners[:, 2:] - corners[:, :2]).T).max() / 2 * metric.lipschitz + max_distance
+    dist, ix = interpolator._index.query(centers, distance_upper_bound=radius)
+    return np.isinf(dist[:, 0])
+
+
+def _tile_bounds(interpolator, x, y, crs=None):
+    """returns the ``x`` and ``y`` of the tile they span in the crs of the
+    interpolator. A tile given in another ``crs`` is replaced by the bounding
+    box of its reprojected boundary, which contains all its reprojected cells."""
+    if crs is None:
+        return x, y
+
+    boundary = np.concatenate((np.column_stack((x, np.full(len(x), y[0]))),
+                               np.column_stack((x, np.full(len(x), y[-1]))),
+                               np.column_stack((np.full(len(y), x[0]), y)),
+                               np.column_stack((np.full(len(y), x[-1]), y))))
+    boundary = reproject(boundary, crs, interpolator.crs, out=boundary)
+    return (np.array([boundary[:, 0].min(), boundary[:, 0].max()]),
+            np.array([boundary[:, 1].min(), boundary[:, 1].max()]))
+
+
+def _tile_halo_indices(interpolator, x, y, nnear, crs=None):
+    """returns the indices of the points needed to find the ``nnear``
+    nearest neighbours of every cell in the tile spanned by ``x`` and ``y``"""
+    center, radius = _tile_halo(interpolator, x, y, nnear, crs)
+    if not np.isfinite(radius):
+        return np.arange(interpolator.tree.n)
+
+    ix = interpolator.tree.query_ball_point(center, radius)
+    return np.sort(np.asarray(ix, dtype=int))
@@ -0,0 +1,156 @@
+"""
+module with optional instrumentation of the hot paths, reporting the wall time, point count and output size of every stage
+"""
+from collections import namedtuple
+from functools import wraps
+import threading
+import time
+
+import numpy as np
+
+Stage = namedtuple('Stage', ['name', 'seconds', 'points', 'nbytes'])
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Call ``hook(stage)`` with a ``Stage`` record every time an
+    instrumented stage finishes, e.g. to send the numbers to a metrics
+    system. Stages are timed only while at least one hook is installed, so
+    instrumentation costs next to nothing otherwise. Hooks are called from
+    whichever thread ran the stage; stages run in worker processes (e.g.
+    ``grid`` with ``executor='process'``) are not reported.
+
+    A ``Stage`` has the ``name`` of the stage, e.g. 'interpolate.query', the
+    wall time in ``seconds``, the number of ``points`` it processed and
+    ``nbytes``, the size of the arrays it produced.
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Remove a hook installed with ``add_hook``"""
+    with _hooks_lock:
+        _hooks.remove(hook)
+
+
+class Profile:
+    """Context manager recording the stages run inside it:
+
+        with Profile() as profile:
+            grid(interpolator, x, y, method='idw')
+        print(profile.report())
+
+    ``stages`` is the list of ``Stage`` records in the order they finished.
+    """
+    def __init__(self):
+        self.stages = []
+
+    def __enter__(self):
+        add_hook(self.stages.append)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_hook(self.stages.append)
+
+    def totals(self):
+        """returns a dict of stage name to a ``Stage`` record summed over all
+        the calls of the stage, and a dict of stage name to its number of
+        calls"""
+        totals = {}
+        calls = {}
+        for stage in self.stages:
+            total = totals.get(stage.name, Stage(stage.name, 0., 0, 0))
+            totals[stage.name] = Stage(stage.name, total.seconds + stage.seconds, total.points + stage.points,
+                                       total.nbytes + stage.nbytes)
+            calls[stage.name] = calls.get(stage.name, 0) + 1
+
+        return totals, calls
+
+    def report(self):
+        """returns a table of the stage totals, slowest first"""
+        totals, calls = self.totals()
+        lines = ["%-40s %8s %12s %14s %12s" % ('stage', 'calls', 'seconds', 'points', 'MB')]
+        for stage in sorted(totals.values(), key=lambda stage: -stage.seconds):
+            lines.append("%-40s %8d %12.6f %14d %12.3f" % (stage.name, calls[stage.name], stage.seconds,
+                                                            stage.points, stage.nbytes / 2**20))
+        return '\n'.join(lines)
+
+
+def stage(name, points=0):
+    """returns a context manager timing the stage ``name`` when hooks are
+    installed. Set ``nbytes`` (and ``points`` if not known up front) on the
+    object it returns:
+
+        with stage('interpolate.query', len(xi)) as s:
+            dist, ix = tree.query(xi)
+            s.nbytes = dist.nbytes + ix.nbytes
+    """
+    if not _hooks:
+        return _DISABLED
+    return _Timer(name, points)
+
+
+def instrumented(name, arg=0):
+    """decorator timing every call of a function as the stage ``name``,
+    counting the length of its positional argument ``arg`` (use 1 for
+    methods) as the number of points and the size of the arrays it returns
+    as ``nbytes``"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fn(*args, **kwargs)
+
+            with _Timer(name, len(args[arg]) if len(args) > arg and hasattr(args[arg], '__len__') else 0) as s:
+                result = fn(*args, **kwargs)
+                s.nbytes = _nbytes(result)
+            return result
+        return wrapper
+    return decorator
+
+
+#---------------------------------------------------------------------------
+# internal functions
+#---------------------------------------------------------------------------
+class _Disabled:
+    """shared do nothing stage used while no hooks are installed"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+class _Timer:
+    def __init__(self, name, points):
+        self.name = name
+        self.points = points
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record = Stage(self.name, time.perf_counter() - self.start, int(self.points), int(self.nbytes))
+        for hook in list(_hooks):
+            hook(record)
+
+
+def _nbytes(result):
+    """returns the total size of the numpy arrays in ``result``, which may be
+    an array or a (nested) tuple or list of arrays"""
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (tuple, list)):
+        return sum(_nbytes(r) for r in result)
+    return 0
@@ -1,87 +1,1318 @@
+from itertools import count
+import json
+import os
+import threading
+
 import numpy as np
-from scipy.interpolate.interpnd import LinearNDInterpolator, CloughTocher2DInterpolator
+from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
+
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree as KDTree, Delaunay
 
-from scipy.spatial import cKDTree as KDTree
+from .cache import LRUCache, array_key
+from .instrument import stage, instrumented
+from .kriging import fit_variogram, _kriging_weights
+from .thiessen import _circumcenters
+from .transform import SN_CoordinateSystem, reproject, _crs
 
 class Interpolator:
-    def __init__(self, points, values, ellipsivity=1., leafsize=10):
+    def __init__(self, points, values, ellipsivity=1., leafsize=10, buffer_size=100000, cache_size=0,
+                 anisotropy=None, coordinate_system=None, crs=None, points_crs=None, precision='double'):
+        """
+        ``points`` and ``values`` may be in memory arrays or read only
+        memory mapped arrays (see ``smear.io``), they are neither modified
+        nor copied. The exceptions are an anisotropic search metric where the
+        tree is built on a transformed copy of the points, points
+        reprojected from ``points_crs``, and values that are not float32
+        with ``precision='single'``, which are cast into a new in memory
+        float32 array.
+
+        Neighbours are searched, and triangulations built, in a search
+        space given by:
+
+        - ``ellipsivity``: factor the x coordinates are multiplied by
+        - ``anisotropy``: either ``(angle, ratio)``, where ``angle`` is the
+          direction of the major axis of the search ellipse in radians
+          counterclockwise from the x axis and ``ratio`` >= 1 is the ratio of
+          its major to minor axis, or a general 2x2 transformation matrix
+        - ``coordinate_system``: an ``SN_CoordinateSystem``, points are
+          first transformed to channel aligned (s, n) coordinates so the
+          anisotropy follows the river. ``ratio`` may then be a function of
+          ``s`` for an anisotropy that varies along the reach.
+
+        Target points are transformed the same way before every query.
+
+        ``crs`` is the coordinate reference system the points are
+        interpolated in (see ``smear.transform.transformer``). Points given
+        in a different ``points_crs``, e.g. geographic survey positions, are
+        reprojected into ``crs`` chunk by chunk into a single new array.
+        Target points (and ``smear.grid`` grids) may then be given in any
+        crs.
+
+        ``values`` is an (n,) or (n, k) array, or a dict of named (n,)
+        columns (e.g. depth, backscatter, uncertainty) which are stacked
+        into an (n, k) array.
+
+        Points added with ``add_points`` or removed with ``remove_points``
+        are kept in a small buffer next to the main KD-tree. Once more than
+        ``buffer_size`` points are pending they are merged into a new main
+        tree in a background thread.
+
+        With ``cache_size`` > 0 the neighbour indices and weights of the
+        nearest, idw and (global) linear methods are cached per target array
+        and query parameters, in a least recently used cache holding at most
+        ``cache_size`` bytes. Repeated target grids are then evaluated by a
+        single weighted sum, including after ``values`` has been replaced,
+        as long as the points are unchanged.
+
+        ``precision='single'`` is a compact mode for very large surveys: the
+        values are stored as float32 and queries run in single precision,
+        with float32 distances and weights and int32 neighbour indices, so
+        the values, the weights cache and the output take half the memory.
+        The points and the KD-tree are unchanged, since coordinates stay
+        float64 (cKDTree has no single precision mode). Every tree query
+        still returns float64 distances and int64 indices before they are
+        cast, so the peak memory of a query block only drops by about a
+        quarter. Only coordinates relative to each target (its local
+        origin) are ever rounded to float32, so projected coordinates far
+        from their origin lose no accuracy. Interpolated values then agree with double
+        precision to within about 1e-6 times the largest absolute
+        neighbour value. Float32 values, e.g. memory mapped from a file
+        written by ``smear.io.xyz_to_npy`` with ``values_dtype=np.float32``,
+        are used as they are.
+        """
+        if precision not in _DTYPES:
+            raise ValueError("Unknown precision %s, expected 'double' or 'single'." % (precision))
+        self.channels = None
+        if isinstance(values, dict):
+            self.channels = list(values)
+            values = np.column_stack([values[name] for name in self.channels])
+
         assert len(points) == len(values), "len(points) %d != len(values) %d" % (len(points), len(values))
-        self.points = points
-        if ellipsivity!=1.:
-            points[:,0] = points[:,0]*ellipsivity
+        if points_crs is not None:
+            if crs is None:
+                crs = points_crs
+            else:
+                points = reproject(points, points_crs, crs)
 
-        self.tree = KDTree(points, leafsize=leafsize )  # build the tree
-        self.values = values
+        self.crs = crs
+        self.precision = precision
+        if precision == 'single':
+            # a view of float32 (memory mapped) values, a copy of any others
+            values = np.asarray(values, dtype=np.float32)
+        self.ellipsivity = ellipsivity
+        self.anisotropy = anisotropy
+        self.coordinate_system = coordinate_system
+        self._metric = _Metric(ellipsivity, anisotropy, coordinate_system)
+        self.leafsize = leafsize
+        self.buffer_size = buffer_size
+        self._cache = LRUCache(cache_size) if cache_size else None
+        self._index = _Index(points, values, _build_tree(points, self._metric, leafsize), self._metric,
+                             dtype=_DTYPES[precision])
+        self._init_updates()
+
+    def _init_updates(self):
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compaction = None
+        self._dirty_points = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_lock', '_compact_lock', '_compaction'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_updates()
+
+    @property
+    def points(self):
+        """points in the main index, this does not include buffered points
+        that have not been compacted yet"""
+        return self._index.points
+
+    @property
+    def values(self):
+        """values of the points in the main index"""
+        return self._index.values
+
+    @values.setter
+    def values(self, values):
+        """replace the values while keeping the point geometry (KD-tree and
+        triangulation)"""
+        if isinstance(values, dict):
+            values = np.column_stack([values[name] for name in self.channels])
+        if self.precision == 'single':
+            values = np.asarray(values, dtype=np.float32)
+
+        self.compact()
+        with self._lock:
+            index = self._index
+            assert len(values) == index.n_main, "len(values) %d != number of points %d" % (len(values), index.n_main)
+            self._index = index.with_values(values)
+
+    @property
+    def tree(self):
+        """KD-tree of the main index"""
+        return self._index.tree
+
+    @property
+    def triangulation(self):
+        """Delaunay triangulation of all the points, built on first use and
+        cached for subsequent calls. Pending updates are compacted first."""
+        if self._index.pending:
+            self.compact()
+        return self._index.triangulation
+
+    @property
+    def variogram(self):
+        """spherical ``Variogram`` used by kriging, fitted in the search space
+        to a subsample of the points (and the first channel of the values)
+        on first use and cached until the values change. Pass another
+        ``Variogram`` (see ``smear.kriging.fit_variogram``) as ``variogram``
+        to use a different model."""
+        return self._index.variogram
+
+    def add_points(self, points, values):
+        """Add points with their values. They are searchable immediately from
+        a buffer that is merged into the main index once it holds more than
+        ``buffer_size`` points."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        if isinstance(values, dict):
+            values = np.column_stack([values[name] for name in self.channels])
+        values = np.asarray(values, dtype=np.float32 if self.precision == 'single' else None)
+        assert len(points) == len(values), "len(points) %d != len(values) %d" % (len(points), len(values))
+
+        with self._lock:
+            self._index = self._index.with_buffer(points, values)
+            self._dirty_points.append(np.array(points, dtype=float))
+        self._compact_if_full()
+
+    def remove_points(self, points):
+        """Remove all points (main or buffered) at exactly the given
+        coordinates, returns the number of points removed."""
+        points = np.atleast_2d(points)
+        with self._lock:
+            index = self._index
+            ix = index.exact_matches(points)
+            if len(ix):
+                self._index = index.with_removed(ix)
+                self._dirty_points.append(np.array(points, dtype=float))
+        self._compact_if_full()
+        return len(ix)
+
+    def pop_dirty_points(self):
+        """returns an (m, 2) array of the coordinates of points added or
+        removed since the last call, see ``smear.grid.dirty_tiles``"""
+        with self._lock:
+            dirty_points, self._dirty_points = self._dirty_points, []
+        if not dirty_points:
+            return np.zeros((0, 2))
+        return np.concatenate(dirty_points)
+
+    def cache_info(self):
+        """returns the hits, misses, entries, nbytes and maxbytes of the
+        weights cache, or None when caching is disabled"""
+        return None if self._cache is None else self._cache.info()
+
+    def cache_clear(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    def compact(self):
+        """Merge buffered and removed points into a new main index now,
+        waiting for any background compaction to finish first."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        self._compact()
+
+    def _compact_if_full(self):
+        index = self._index
+        compaction = self._compaction
+        if index.n_pending > self.buffer_size and (compaction is None or not compaction.is_alive()):
+            self._compaction = threading.Thread(target=self._compact)
+            self._compaction.daemon = True
+            self._compaction.start()
+
+    def _compact(self):
+        """rebuild the main index from a snapshot without holding the lock,
+        then swap it in keeping any updates made in the meantime"""
+        with self._compact_lock:
+            snapshot = self._index
+            if not snapshot.pending:
+                return
+
+            keep = np.ones(snapshot.n, dtype=bool)
+            keep[snapshot.removed] = False
+            keep = np.flatnonzero(keep)
+            points = snapshot.take_points(keep)
+            values = snapshot.take_values(keep)
+            tree = _build_tree(points, self._metric, self.leafsize)
+
+            with self._lock:
+                current = self._index
+                n_buffered = snapshot.n - snapshot.n_main
+                buffer_points = buffer_values = None
+                if current.n - current.n_main > n_buffered:
+                    buffer_points = current.buffer_points[n_buffered:]
+                    buffer_values = current.buffer_values[n_buffered:]
+
+                # renumber removals made during the compaction
+                removed = np.setdiff1d(current.removed, snapshot.removed)
+                removed = np.where(removed < snapshot.n, np.searchsorted(keep, removed),
+                                   len(keep) + removed - snapshot.n)
+
+                self._index = _Index(points, values, tree, self._metric, buffer_points, buffer_values, removed,
+                                     dtype=snapshot.dtype)
+
+    def save(self, path):
+        """Save the points, values, KD-tree and any cached triangulation to
+        the directory ``path`` so that ``Interpolator.load`` can reuse them
+        without rebuilding. Arrays are stored as uncompressed .npy files
+        which ``load`` memory maps. Pending updates are compacted first.
+
+        The search metric is saved as its matrix, the centerline of a
+        ``coordinate_system`` and, for an anisotropy ratio varying along s,
+        the sampled stretch of s rather than the ratio function, so the
+        ``anisotropy`` of the loaded interpolator is then ``(angle, None)``.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.compact()
+        index = self._index
+        np.save(os.path.join(path, 'points.npy'), index.points)
+        np.save(os.path.join(path, 'values.npy'), index.values)
+
+        # the pickled state holds a copy of the tree data, save the data itself
+        # so that it is only stored once when it is the points. The layout of
+        # the state tuple is private to scipy, so check it is the data first.
+        tree_state = dict(enumerate(index.tree.__getstate__()))
+        triangulation_shared = {'points': index.points}
+        if np.shape(tree_state.get(1)) == index.tree.data.shape and np.array_equal(tree_state[1], index.tree.data):
+            tree_state[1] = index.tree.data
+            triangulation_shared['tree.1'] = index.tree.data
+        meta = {
+            'format': _SAVE_FORMAT,
+            'leafsize': self.leafsize,
+            'buffer_size': self.buffer_size,
+            'cache_size': 0 if self._cache is None else self._cache.maxbytes,
+            'channels': self.channels,
+            'crs': None if self.crs is None else _crs(self.crs).to_wkt(),
+            'precision': self.precision,
+            'metric': _save_state(path, 'metric', self._metric.__getstate__(), shared={}),
+            'tree': _save_state(path, 'tree', tree_state, shared={'points': index.points}),
+            'triangulation': None,
+        }
+        if index._triangulation is not None:
+            # Delaunay pickles its attribute dict, ``load`` restores it with ``__dict__.update``
+            meta['triangulation'] = _save_state(path, 'triangulation', vars(index._triangulation),
+                                                shared=triangulation_shared)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """Load an Interpolator saved with ``save``. The arrays are memory
+        mapped copy on write, so loading takes roughly constant time and the
+        files on disk are never modified.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format'] != _SAVE_FORMAT:
+            raise ValueError("Unsupported Interpolator format %s in %s" % (meta['format'], path))
+
+        self = cls.__new__(cls)
+        self._metric = _Metric.__new__(_Metric)
+        self._metric.__setstate__(_load_state(path, 'metric', meta['metric'], {}))
+        self.ellipsivity = self._metric.ellipsivity
+        self.anisotropy = self._metric.anisotropy
+        self.coordinate_system = self._metric.coordinate_system
+        self.leafsize = meta['leafsize']
+        self.buffer_size = meta['buffer_size']
+        self._cache = LRUCache(meta['cache_size']) if meta['cache_size'] else None
+        self.channels = meta['channels']
+        self.crs = meta.get('crs')
+        self.precision = meta.get('precision', 'double')
+        self._init_updates()
+
+        points = np.load(os.path.join(path, 'points.npy'), mmap_mode='r')
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        loaded = {'points': points}
+        state = _load_state(path, 'tree', meta['tree'], loaded)
+        tree = KDTree.__new__(KDTree)
+        tree.__setstate__(tuple(state[str(i)] for i in range(len(state))))
+        loaded['tree.1'] = tree.data
+        self._index = _Index(points, values, tree, self._metric, dtype=_DTYPES[self.precision])
+
+        if meta['triangulation'] is not None:
+            triangulation = Delaunay.__new__(Delaunay)
+            # Delaunay pickles its attribute dict, restore it the same way pickle does
+            triangulation.__dict__.update(_load_state(path, 'triangulation', meta['triangulation'], loaded))
+            self._index._triangulation = triangulation
+
+        return self
+
+    def __call__(self, xi, method='nearest', crs=None, **kwargs):
+        """Interpolate values at the target points ``xi``.
+
+        ``method`` is one of 'nearest', 'idw', 'linear' or 'cubic'. By default
+        the linear and cubic methods use a single Delaunay triangulation of
+        all the points that is built once and cached, so every target is
+        answered by a vectorized simplex lookup. Passing
+        ``triangulation='local'`` instead triangulates the ``nnear`` nearest
+        neighbours of every target separately (much slower, but it will
+        return values outside the convex hull of the points whenever the
+        target lies within the hull of its neighbours).
+
+        'natural' is Sibson natural neighbour interpolation on the same
+        cached global triangulation: smoother than linear, exact at the
+        points and linear precision, with weights found for whole blocks of
+        targets at once. Targets outside the convex hull are NaN.
 
-    def __call__(self, xi, method='nearest', nnear=6, eps=0, threshold=1e-10, **kwargs):
+        All channels of (n, k) values, or of a dict of named value columns,
+        are interpolated together from a single neighbour search and a
+        single set of weights. For a dict a dict of interpolated columns is
+        returned.
 
-        if method == 'nearest':
-            dist, ix = self.tree.query(xi)
-            return self.values[ix,]
-        elif method in ('linear', 'cubic', 'idw'):
+        Target points given in a ``crs`` other than the crs of the
+        interpolator are reprojected first.
+
+        ``max_distance`` limits the search to points within that distance
+        (measured in the search space). Targets with fewer than
+        ``min_neighbours`` points within it, e.g. grid cells in the gaps of a
+        survey, are NaN and are skipped after a single short tree search.
+        nearest, idw and kriging only use the points within ``max_distance``,
+        so the neighbourhood adapts to the local point density: up to ``nnear``
+        points in densely sampled areas, fewer where the points are sparse.
+        It only shrinks. ``nnear`` is the most points used, so pass a larger
+        ``nnear`` to use more of the points within ``max_distance`` where the
+        survey is dense.
+
+        'kriging' is local ordinary kriging from the ``nnear`` nearest
+        neighbours with ``variogram`` (by default ``self.variogram``). The
+        kriging systems of a block of targets are solved together in one
+        batched solve. With ``return_variance=True`` a tuple of the
+        interpolated values and the kriging variance of every target is
+        returned.
+
+        For idw, ``weights`` gives a declustering weight for each of
+        ``self.points``, e.g. the areas of their clipped thiessen polygons
+        (``smear.thiessen.thiessen_areas``), by which the inverse distance
+        weights are multiplied so that clusters of closely spaced points do
+        not dominate.
+        """
+        interpolated_values = self._interpolate(self._from_crs(xi, crs), method, **kwargs)
+        if isinstance(interpolated_values, tuple):
+            interpolated_values, variance = interpolated_values
+            return self._as_channels(interpolated_values), variance
+
+        return self._as_channels(interpolated_values)
+
+    def _as_channels(self, interpolated_values):
+        """returns a dict of the named channels of ``interpolated_values``, if any"""
+        if self.channels is None:
+            return interpolated_values
+
+        return dict((name, interpolated_values[..., n]) for n, name in enumerate(self.channels))
+
+    def _from_crs(self, xi, crs):
+        """returns the target points ``xi`` given in ``crs`` reprojected into the crs of the interpolator"""
+        if crs is None:
+            return xi
+        if self.crs is None:
+            raise ValueError("Target points in crs %s need an Interpolator with a crs" % (crs,))
+
+        # a single (2,) point is reprojected as a row and keeps its shape
+        return reproject(np.atleast_2d(xi), crs, self.crs).reshape(np.shape(xi))
+
+    def operator(self, xi, method='nearest', nnear=6, eps=0, threshold=1e-10, block_size=65536,
+                 triangulation='global', power=1, weights=None, variogram=None):
+        """Return the interpolation onto the target points ``xi`` as a sparse
+        (len(xi), len(points)) CSR matrix ``W``, so that ``W @ values`` equals
+        ``self(xi, method, ...)`` for any values on the same points.
+        Pending updates are compacted first so that the columns match
+        ``self.points``.
+
+        nearest, idw, natural, kriging and linear (global or local) are
+        exactly linear in the values. For cubic the matrix is a local approximation: the
+        Clough-Tocher weights of the ``nnear`` nearest neighbours of each
+        target, i.e. ``triangulation='local'`` cubic interpolation with the
+        gradient estimation converged for unit values. Targets outside the
+        triangulation have NaN weights, so their rows give NaN.
+
+        The matrix can be stored with ``scipy.sparse.save_npz`` and shared
+        between workers.
+        """
+        if weights is not None:
+            if method != 'idw':
+                raise ValueError("Point weights are only used by idw, not by %s." % (method))
+            self._check_weights(weights)
+        self.compact()
+        index = self._index
+        xi = np.atleast_2d(xi)
+        if len(xi) == 0:
+            return csr_matrix((0, index.n), dtype=index.dtype)
+
+        point_weights = weights
+        if method == 'kriging':
+            block_size = _kriging_block_size(block_size, nnear, index.dtype)
+        weights = []
+        for start in range(0, len(xi), block_size):
+            block = slice(start, start + block_size)
+            if method in _WEIGHTED_METHODS or (method == 'linear' and triangulation == 'global'):
+                w, ix = _weights(index, xi[block], method, nnear, eps, threshold, power, point_weights,
+                                 variogram=variogram)
+                if w is None:
+                    w = np.ones(ix.shape)
+            elif method in ('linear', 'cubic'):
+                if method == 'linear' and triangulation != 'local':
+                    raise ValueError("Unknown triangulation %s, expected 'global' or 'local'." % (triangulation))
+                w, ix = _local_weights(index, xi[block], method, nnear, eps, threshold)
+            else:
+                raise ValueError("Unknown interpolation method %s." % (method))
+            weights.append((w, ix))
+
+        w, ix = _concatenate_weights(weights)
+        indptr = np.arange(0, w.size + 1, w.shape[1])
+        return csr_matrix((w.ravel(), ix.ravel(), indptr), shape=(len(xi), index.n))
+
+    def _interpolate(self, xi, method='nearest', nnear=6, eps=0, threshold=1e-10, block_size=65536,
+                     triangulation='global', max_distance=None, min_neighbours=1, distance_upper_bound=np.inf,
+                     **kwargs):
+        """returns the interpolated values as an array, see ``__call__``"""
+        if max_distance is not None:
+            return self._interpolate_within(xi, method, max_distance, min_neighbours,
+                                            dict(kwargs, nnear=nnear, eps=eps, threshold=threshold,
+                                                 block_size=block_size, triangulation=triangulation))
+        if kwargs.get('weights') is not None:
+            if method != 'idw':
+                raise ValueError("Point weights are only used by idw, not by %s." % (method))
+            self._check_weights(kwargs['weights'])
+
+        global_triangulation = method == 'natural' or method in ('linear', 'cubic') and triangulation == 'global'
+        if global_triangulation and self._index.pending:
+            self.compact()
+
+        # all blocks are answered from the same snapshot of the index
+        index = self._index
+
+        if kwargs.get('return_variance') and method != 'kriging':
+            raise ValueError("The variance is only returned by kriging, not by %s." % (method))
+
+        if method in _WEIGHTED_METHODS or (method == 'linear' and triangulation == 'global'):
+            return self._weighted_blocks(index, xi, method, nnear, eps, threshold, block_size,
+                                         distance_upper_bound=distance_upper_bound, **kwargs)
+        elif method == 'cubic' and triangulation == 'global':
+            return self._global_cubic_blocks(index, xi, block_size)
+        elif method in ('linear', 'cubic'):
+            if triangulation != 'local':
+                raise ValueError("Unknown triangulation %s, expected 'global' or 'local'." % (triangulation))
             #todo raise error if nnear too small for interp type.
-            dist, ix = self.tree.query(xi, k=nnear, eps=eps )
+            single_point = np.ndim(xi) == 1
+            xi = np.atleast_2d(xi)
+            dist, ix = index.query(xi, k=nnear, eps=eps )
 
             #directly assign nearest nieghbour for xi that are closer than threshold to a point
-            interpolated_values = np.zeros((len(dist),) + np.shape(self.values[0]))
-            below_threshold = dist[:,0] < threshold
-            interpolated_values[below_threshold] = self.values[ix[below_threshold][:,0],]
+            with stage('interpolate.threshold', len(xi)):
+                interpolated_values = np.zeros((len(dist),) + np.shape(index.values[0]), dtype=index.dtype)
+                below_threshold = dist[:,0] < threshold
+                interpolated_values[below_threshold] = index.take_values(ix[below_threshold][:,0])
 
             n_interp = 0
-            above_threshold = interpolated_values[~below_threshold,:]
-            interpolator_fn = getattr(self, '_' + method)
-            for dist, ix in zip(dist[~below_threshold], ix[~below_threshold]):                
-                above_threshold[n_interp] = interpolator_fn(dist, ix, n_interp, xi, **kwargs)
-                n_interp += 1
+            above_threshold = interpolated_values[~below_threshold]
+            xi_above = index.metric(xi[~below_threshold])
+            interpolator_fn = _local_linear if method == 'linear' else _local_cubic
+            with stage('interpolate.local_triangulation', len(xi_above)) as s:
+                for ix in ix[~below_threshold]:
+                    above_threshold[n_interp] = interpolator_fn(index.take_tree_points(ix), index.take_values(ix),
+                                                                xi_above[n_interp])
+                    n_interp += 1
+                s.nbytes = above_threshold.nbytes
+
+            interpolated_values[~below_threshold] = above_threshold
 
-            interpolated_values[~below_threshold,:] = above_threshold
+            return interpolated_values[0] if single_point else interpolated_values
 
-            return interpolated_values if xi.ndim > 1 else interpolated_values[0]
-        
         else:
             raise ValueError("Unknown interpolation method %s." % (method))
-        
-    def _cubic(self, dist, ix, n_interp, xi):
-        return CloughTocher2DInterpolator(self.points[ix], self.values[ix])(np.array([xi[n_interp]]))
+
+    def _interpolate_within(self, xi, method, max_distance, min_neighbours, kwargs):
+        """Interpolate only the targets with at least ``min_neighbours``
+        points within ``max_distance``, the others are NaN. A single k =
+        ``min_neighbours`` query bounded by ``max_distance`` finds them, so
+        targets in data gaps cost one short tree search. For nearest and idw
+        the neighbour search of the remaining targets is bounded by
+        ``max_distance`` as well.
+        """
+        single_point = np.ndim(xi) == 1
+        xi = np.atleast_2d(xi)
+        with stage('interpolate.coverage', len(xi)) as s:
+            dist, ix = self._index.query(xi, k=min_neighbours, distance_upper_bound=max_distance)
+            covered = np.isfinite(dist[:, -1])
+            s.nbytes = covered.nbytes
+
+        interpolated_values = np.full((len(xi),) + np.shape(self._index.values[0]), np.nan, dtype=self._index.dtype)
+        variance = np.full(len(xi), np.nan, dtype=self._index.dtype)
+        if np.any(covered):
+            covered_values = self._interpolate(xi[covered], method, distance_upper_bound=max_distance, **kwargs)
+            if isinstance(covered_values, tuple):
+                covered_values, variance[covered] = covered_values
+            interpolated_values[covered] = covered_values
+
+        if single_point:
+            interpolated_values, variance = interpolated_values[0], variance[0]
+        return (interpolated_values, variance) if kwargs.get('return_variance') else interpolated_values
+
+    def _global_cubic_blocks(self, index, xi, block_size):
+        """Cubic interpolation with a Clough-Tocher interpolant built once on
+        the cached global triangulation. Targets outside the convex hull are
+        NaN.
+        """
+        single_point = np.ndim(xi) == 1
+        xi = np.atleast_2d(xi)
+        interpolated_values = np.empty((len(xi),) + np.shape(index.values[0]), dtype=index.dtype)
+
+        cubic_interpolator = index.cubic_interpolator
+        for start in range(0, len(xi), block_size):
+            block = slice(start, start + block_size)
+            with stage('interpolate.cubic', len(xi[block])):
+                interpolated_values[block] = cubic_interpolator(index.metric(xi[block]))
+
+        return interpolated_values[0] if single_point else interpolated_values
 
     def _idw(self, dist, ix, n_interp, xi, power=1):
-        """Inverse Distance Weighted Interpolation.
+        """Inverse Distance Weighted Interpolation for a single target point.
+
+        This is the per point reference implementation, ``__call__`` uses the
+        vectorized ``_weighted_blocks`` which gives identical results.
 
         Parameters
         ----------
-        X_new: numpy array, shape = (n, 2) 
-            Target interpolation points. 
+        dist: numpy array, shape = (nnear,)
+            distances from the target point to its nearest neighbours
 
-        eps : nonnegative float, optional (default=0)
-            Return approximate nearest neighbors; the kth returned value is 
-            guaranteed to be no further than (1+eps) times the distance to the real kth nearest neighbor.
-
-        nnear: integer, optional (default = 6)
-            number of nearest neighbours to use for each target point 
+        ix: numpy array, shape = (nnear,)
+            indices of the nearest neighbours in ``self.points``
 
         power: integer
 
-        threshold: nonnegative float
-            threshold distance below which target points are considered equivalent to existing point and values used directly 
-
-        Examples
-        --------
-        >>> from sklearn.neighbors.nearest_centroid import NearestCentroid
-        [1]
-
         References
         ----------
         http://stackoverflow.com/questions/3104781/inverse-distance-weighted-idw-interpolation-with-python
         """
-        
+
         w = 1 / dist**power
         w /= np.sum(w)
 
-        return np.dot(w, self.values[ix,])
+        return np.dot(w, self._index.take_values(ix))
+
+    def _check_weights(self, weights):
+        """compact pending updates so that ``weights`` can refer to ``self.points``"""
+        self.compact()
+        if len(weights) != self._index.n:
+            raise ValueError("Found %d point weights for %d points" % (len(weights), self._index.n))
+
+    def _weighted_blocks(self, index, xi, method, nnear, eps, threshold, block_size, power=1, weights=None,
+                         distance_upper_bound=np.inf, variogram=None, return_variance=False):
+        """Vectorized interpolation for the methods that are a weighted sum of
+        neighbour values: nearest, idw, kriging, and linear and natural on the
+        global triangulation.
+
+        Target points are processed ``block_size`` at a time, for each block a
+        single ``tree.query`` (or ``find_simplex``) is made and the weights of
+        every target in the block are computed at once from the returned
+        ``(dist, ix)`` arrays. Memory use is therefore bounded by
+        ``block_size * nnear`` regardless of the number of target points,
+        unless the weights are being cached. Kriging builds a
+        ``(nnear + 1) x (nnear + 1)`` system per target, so its blocks are
+        further limited to ``_KRIGING_BLOCK_BYTES`` (see
+        ``_kriging_block_size``).
+
+        Parameters
+        ----------
+        index: _Index
+            snapshot of the points to interpolate from
+
+        xi: numpy array, shape = (n, 2)
+            Target interpolation points.
+
+        method: string
+            'nearest', 'idw' or 'linear'
+
+        nnear: integer
+            number of nearest neighbours to use for each target point
+
+        eps : nonnegative float
+            Return approximate nearest neighbors; the kth returned value is
+            guaranteed to be no further than (1+eps) times the distance to the real kth nearest neighbor.
+
+        threshold: nonnegative float
+            threshold distance below which target points are considered equivalent to existing point and values used directly
+
+        block_size: integer
+            number of target points interpolated per block
+
+        power: integer
+
+        weights: numpy array, shape = (len(points),), optional
+            declustering weights of the points for idw, e.g. the areas of
+            their thiessen polygons (see ``smear.thiessen.thiessen_areas``)
+
+        distance_upper_bound: float
+            neighbours of nearest, idw and kriging are only searched up to
+            this distance, every target must have at least one neighbour
+            within it
+
+        variogram: Variogram, optional
+            variogram of kriging, by default the one fitted to the points
+
+        return_variance: bool
+            also return the kriging variance of every target. The variance
+            is computed with the weights, so the weights cache is bypassed.
+        """
+        single_point = np.ndim(xi) == 1
+        xi = np.atleast_2d(xi)
+        if method == 'kriging' and variogram is None:
+            variogram = index.variogram
+
+        key = None
+        if self._cache is not None and not return_variance:
+            key = array_key(xi, index.geometry, method, nnear, eps, threshold, power, distance_upper_bound,
+                            None if weights is None else array_key(weights),
+                            None if variogram is None else variogram.params)
+            cached = self._cache.get(key)
+            if cached is not None:
+                interpolated_values = _evaluate_weights(index, *cached)
+                return interpolated_values[0] if single_point else interpolated_values
+
+        interpolated_values = np.empty((len(xi),) + np.shape(index.values[0]), dtype=index.dtype)
+        variance = np.empty(len(xi), dtype=index.dtype) if return_variance else None
+        if method == 'kriging':
+            block_size = _kriging_block_size(block_size, nnear, index.dtype)
+        blocks = []
+        for start in range(0, len(xi), block_size):
+            block = slice(start, start + block_size)
+            if return_variance:
+                w, ix, variance[block] = _kriging(index, xi[block], nnear, eps, threshold, variogram,
+                                                  distance_upper_bound)
+            else:
+                w, ix = _weights(index, xi[block], method, nnear, eps, threshold, power, weights,
+                                 distance_upper_bound, variogram)
+            interpolated_values[block] = _evaluate_weights(index, w, ix)
+            if key is not None:
+                blocks.append((w, ix))
+
+        # there is nothing to cache for an empty target array
+        if key is not None and blocks:
+            self._cache.put(key, (None, np.concatenate([ix for w, ix in blocks])) if method == 'nearest'
+                            else _concatenate_weights(blocks))
+
+        if single_point:
+            interpolated_values, variance = interpolated_values[0], None if variance is None else variance[0]
+        return (interpolated_values, variance) if return_variance else interpolated_values
+
+
+class _Index:
+    """Snapshot of the searchable points: the main KD-tree, a small buffer of
+    recently added points and the sorted indices of removed points. Indices
+    ``>= n_main`` refer to buffered points. Updates return a new snapshot, so
+    a query is never affected by a concurrent update or compaction.
+    """
+    def __init__(self, points, values, tree, metric, buffer_points=None, buffer_values=None, removed=None,
+                 dtype=np.float64):
+        self.points = points
+        self.values = values
+        self.tree = tree
+        self.metric = metric
+        self.buffer_points = buffer_points
+        self.buffer_values = buffer_values
+        self.buffer_tree = None
+        if buffer_points is not None:
+            self.buffer_tree = _build_tree(buffer_points, metric, 10)
+        self.removed = np.zeros(0, dtype=int) if removed is None else removed
+        # float dtype of the query pipeline, see the precision of ``Interpolator``
+        self.dtype = dtype
+
+        # identifies the point geometry, shared by snapshots that only differ in values
+        self.geometry = next(_geometry_ids)
+        self.n_main = tree.n
+        self.n = self.n_main + (0 if buffer_points is None else len(buffer_points))
+        self._triangulation = None
+        self._cubic_interpolator = None
+        self._circumcircles = None
+        self._variogram = None
+
+    @property
+    def n_pending(self):
+        return self.n - self.n_main + len(self.removed)
+
+    @property
+    def pending(self):
+        return self.n_pending > 0
+
+    @property
+    def triangulation(self):
+        if self._triangulation is None:
+            with stage('interpolate.triangulation', self.n_main) as s:
+                self._triangulation = Delaunay(self.tree.data)
+                s.nbytes = self._triangulation.simplices.nbytes + self._triangulation.neighbors.nbytes
+        return self._triangulation
+
+    @property
+    def cubic_interpolator(self):
+        """Clough-Tocher interpolant on the global triangulation"""
+        if self._cubic_interpolator is None:
+            triangulation = self.triangulation
+            with stage('interpolate.cubic_gradients', self.n_main):
+                self._cubic_interpolator = CloughTocher2DInterpolator(triangulation, self.values)
+        return self._cubic_interpolator
+
+    @property
+    def circumcircles(self):
+        """``(centers, radii**2)`` of the circumcircles of the triangles of
+        the global triangulation. The centers are relative to the first
+        vertex of each triangle, so projected coordinates far from their
+        origin are never squared."""
+        if self._circumcircles is None:
+            tri = self.triangulation
+            with stage('interpolate.circumcircles', len(tri.simplices)) as s:
+                vertices = tri.points[tri.simplices]
+                centers = _circumcenters(vertices - vertices[:, :1])
+                radii2 = np.sum(centers**2, axis=1)
+                s.nbytes = centers.nbytes + radii2.nbytes
+            self._circumcircles = centers, radii2
+        return self._circumcircles
+
+    @property
+    def variogram(self):
+        """variogram fitted to the main points and values"""
+        if self._variogram is None:
+            with stage('interpolate.variogram', self.n_main):
+                self._variogram = fit_variogram(self.tree.data, self.values)
+        return self._variogram
+
+    def with_values(self, values):
+        index = _Index(self.points, values, self.tree, self.metric, dtype=self.dtype)
+        index.geometry = self.geometry
+        index._triangulation = self._triangulation
+        index._circumcircles = self._circumcircles
+        return index
+
+    def with_buffer(self, points, values):
+        if self.buffer_points is not None:
+            points = np.concatenate((self.buffer_points, points))
+            values = np.concatenate((self.buffer_values, values))
+        index = _Index(self.points, self.values, self.tree, self.metric, points, values, self.removed,
+                       dtype=self.dtype)
+        index._variogram = self._variogram
+        return index
+
+    def with_removed(self, ix):
+        index = _Index(self.points, self.values, self.tree, self.metric, self.buffer_points,
+                       self.buffer_values, np.union1d(self.removed, ix), dtype=self.dtype)
+        index._variogram = self._variogram
+        return index
+
+    @instrumented('interpolate.query', arg=1)
+    def query(self, xi, k=1, eps=0, distance_upper_bound=np.inf):
+        """returns ``(dist, ix)`` arrays of shape (m, k) of the k nearest
+        points that have not been removed, with distances measured in the
+        search space. Missing neighbours, including those farther than
+        ``distance_upper_bound``, have infinite distance and index ``n``.
+        In single precision they are float32 and int32 arrays, cast from
+        the float64 and int64 arrays of the tree query."""
+        dist, ix = self._query(xi, k, eps, distance_upper_bound)
+        if self.dtype == np.float32:
+            return dist.astype(np.float32), ix.astype(np.int32 if self.n < 2**31 else np.intp)
+        return dist, ix
+
+    def _query(self, xi, k, eps, distance_upper_bound):
+        xi = self.metric(np.atleast_2d(xi))
+        if not self.pending:
+            dist, ix = self.tree.query(xi, k=k, eps=eps, distance_upper_bound=distance_upper_bound)
+            return _as_2d(dist, ix, k)
+
+        # over query the main tree by the number of removed main points
+        k_main = min(k + np.searchsorted(self.removed, self.n_main), self.n_main)
+        dist, ix = _as_2d(*self.tree.query(xi, k=k_main, eps=eps, distance_upper_bound=distance_upper_bound),
+                          k=k_main)
+        ix[ix == self.n_main] = self.n
+
+        if self.buffer_tree is not None:
+            k_buffer = min(k + len(self.removed), self.buffer_tree.n)
+            buffer_dist, buffer_ix = _as_2d(*self.buffer_tree.query(xi, k=k_buffer, eps=eps,
+                                                                    distance_upper_bound=distance_upper_bound),
+                                            k=k_buffer)
+            buffer_ix[buffer_ix == self.buffer_tree.n] = self.n - self.n_main
+            buffer_ix += self.n_main
+            dist = np.hstack((dist, buffer_dist))
+            ix = np.hstack((ix, buffer_ix))
+
+        if len(self.removed):
+            removed = np.isin(ix, self.removed)
+            dist[removed] = np.inf
+            ix[removed] = self.n
+
+        order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+        dist = np.take_along_axis(dist, order, axis=1)
+        ix = np.take_along_axis(ix, order, axis=1)
+        if dist.shape[1] < k:
+            missing = k - dist.shape[1]
+            dist = np.hstack((dist, np.full((len(dist), missing), np.inf)))
+            ix = np.hstack((ix, np.full((len(ix), missing), self.n)))
+
+        return dist, ix
+
+    def exact_matches(self, points):
+        """returns the sorted indices of the points (not already removed) at
+        exactly the given coordinates"""
+        scaled = self.metric(points)
+        ix = [np.asarray(i, dtype=int) for i in self.tree.query_ball_point(scaled, 0.)]
+        if self.buffer_tree is not None:
+            ix += [np.asarray(i, dtype=int) + self.n_main for i in self.buffer_tree.query_ball_point(scaled, 0.)]
+
+        return np.setdiff1d(np.concatenate(ix), self.removed)
+
+    def take_points(self, ix):
+        return self._take(ix, self.points, self.buffer_points)
+
+    def take_tree_points(self, ix):
+        return self._take(ix, self.tree.data, None if self.buffer_tree is None else self.buffer_tree.data)
+
+    def take_values(self, ix):
+        return self._take(ix, self.values, self.buffer_values)
+
+    def _take(self, ix, main, buffer):
+        if buffer is None:
+            return main[ix]
+
+        in_main = ix < self.n_main
+        taken = np.empty(np.shape(ix) + main.shape[1:], dtype=np.result_type(main, buffer))
+        taken[in_main] = main[ix[in_main]]
+        taken[~in_main] = buffer[ix[~in_main] - self.n_main]
+        return taken
+
+
+_SAVE_FORMAT = 2
+
+_DTYPES = {'double': np.float64, 'single': np.float32}
+
+# memory budget of the stacked kriging systems of one block of targets
+_KRIGING_BLOCK_BYTES = 2**26
+
+# methods computed by ``_weights`` as weighted sums of neighbour values
+_WEIGHTED_METHODS = ('nearest', 'idw', 'natural', 'kriging')
+
+_geometry_ids = count()
+
+
+class _Metric:
+    """Maps points into the search space of an ``Interpolator``, see
+    ``Interpolator.__init__`` for the parameters."""
+    def __init__(self, ellipsivity=1., anisotropy=None, coordinate_system=None):
+        self.ellipsivity = ellipsivity
+        self.anisotropy = anisotropy
+        self.coordinate_system = coordinate_system
+
+        self.stretch = None
+        matrix = np.diag([ellipsivity, 1.])
+        if anisotropy is not None and np.shape(anisotropy) == (2, 2):
+            matrix = np.dot(np.asarray(anisotropy, dtype=float), matrix)
+        elif anisotropy is not None:
+            angle, ratio = anisotropy
+            if callable(ratio):
+                if coordinate_system is None:
+                    raise ValueError("An anisotropy ratio varying along s requires a coordinate_system")
+                self.stretch = _along_channel_stretch(coordinate_system, ratio)
+                ratio = 1.
+
+            # rotate the major axis onto x and shrink it by ratio
+            rotation = np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+            matrix = np.dot(np.dot(np.diag([1. / ratio, 1.]), rotation), matrix)
+
+        self._set_matrix(matrix)
+
+    def _set_matrix(self, matrix):
+        self.matrix = matrix
+        self.identity = self.coordinate_system is None and np.array_equal(matrix, np.eye(2))
+
+        # bound on how much distances grow in the search space, unbounded
+        # for the non linear s, n transform
+        self.lipschitz = None if self.coordinate_system is not None else np.linalg.norm(matrix, 2)
+
+    def __getstate__(self):
+        """returns the metric as arrays and json serializable values. The
+        ratio function of an anisotropy varying along s is replaced by
+        None, its sampled ``stretch`` is kept instead."""
+        anisotropy = self.anisotropy
+        if self.stretch is not None:
+            anisotropy = (anisotropy[0], None)
+        coordinate_system = self.coordinate_system
+        return {
+            'ellipsivity': self.ellipsivity,
+            'anisotropy': anisotropy,
+            'matrix': self.matrix,
+            'stretch_s': None if self.stretch is None else self.stretch[0],
+            'stretch': None if self.stretch is None else self.stretch[1],
+            'centerline': None if coordinate_system is None else coordinate_system._vertices,
+            'slope_distance': None if coordinate_system is None else coordinate_system.slope_distance,
+            'chunk_size': None if coordinate_system is None else coordinate_system.chunk_size,
+        }
+
+    def __setstate__(self, state):
+        self.ellipsivity = state['ellipsivity']
+        self.anisotropy = state['anisotropy']
+        self.coordinate_system = None
+        if state['centerline'] is not None:
+            centerline = np.asarray(state['centerline'])
+            self.coordinate_system = SN_CoordinateSystem(centerline[:, 0], centerline[:, 1],
+                                                         slope_distance=state['slope_distance'],
+                                                         chunk_size=state['chunk_size'])
+        self.stretch = None
+        if state['stretch'] is not None:
+            self.stretch = (np.asarray(state['stretch_s']), np.asarray(state['stretch']))
+        self._set_matrix(np.asarray(state['matrix']))
+
+    def __call__(self, points):
+        """returns the points transformed into the search space, the points
+        themselves for the identity metric"""
+        if self.identity:
+            return points
+
+        points = np.asarray(points, dtype=float)
+        if self.coordinate_system is not None:
+            s, n = self.coordinate_system.transform_xy_to_sn(points[..., 0].ravel(), points[..., 1].ravel())
+            if self.stretch is not None:
+                s = np.interp(s, *self.stretch)
+            points = np.stack((s, n), axis=-1).reshape(points.shape)
+
+        return np.dot(points, self.matrix.T)
+
+
+def _along_channel_stretch(coordinate_system, ratio):
+    """returns ``(s, stretched s)`` sample arrays of the integral of
+    ``1 / ratio(s)`` along the centerline"""
+    s = np.linspace(0, coordinate_system.centerline.length, 1001)
+    rate = 1. / np.asarray(ratio(s), dtype=float) * np.ones(len(s))
+    stretched = np.concatenate(([0.], np.cumsum((rate[1:] + rate[:-1]) / 2 * np.diff(s))))
+    return s, stretched
+
+
+def _build_tree(points, metric, leafsize):
+    # cKDTree references float64 C ordered points without copying
+    with stage('interpolate.build_tree', len(points)) as s:
+        tree = KDTree(metric(points), leafsize=leafsize)
+        s.nbytes = tree.data.nbytes
+    return tree
+
+
+def _as_2d(dist, ix, k):
+    """cKDTree.query drops the neighbour axis for k=1, restore it"""
+    if k == 1:
+        return dist[..., np.newaxis], ix[..., np.newaxis]
+    return dist, ix
+
+
+def _save_state(path, name, state, shared):
+    """save the arrays in the ``state`` dict as ``<name>.<key>.npy`` files in
+    ``path`` and return a json serializable description of the state.
+    Arrays sharing memory with one of the ``shared`` arrays, which are
+    saved elsewhere, are only referenced by name.
+    """
+    description = {}
+    for key, value in state.items():
+        if isinstance(value, np.ndarray):
+            shared_name = [k for k, v in shared.items() if value.shape == v.shape and np.shares_memory(value, v)]
+            if shared_name:
+                description[key] = {'shared': shared_name[0]}
+            else:
+                filename = '%s.%s.npy' % (name, key)
+                np.save(os.path.join(path, filename), value)
+                description[key] = {'file': filename}
+        else:
+            description[key] = {'value': value.item() if isinstance(value, np.generic) else value}
+
+    return description
+
+
+def _load_state(path, name, description, shared):
+    """inverse of ``_save_state``, returns the state dict (with string keys)
+    with arrays memory mapped copy on write"""
+    state = {}
+    for key, value in description.items():
+        if 'shared' in value:
+            value = shared[value['shared']]
+        elif 'file' in value:
+            value = np.load(os.path.join(path, value['file']), mmap_mode='c')
+        else:
+            value = value['value']
+        state[key] = value
+
+    return state
+
+
+def _local_cubic(points, values, xi):
+    return CloughTocher2DInterpolator(points, values)(np.array([xi]))[0]
+
+
+def _local_linear(points, values, xi):
+    return LinearNDInterpolator(points, values)(np.array([xi]))[0]
+
+
+def _weights(index, xi, method, nnear, eps, threshold, power, point_weights=None, distance_upper_bound=np.inf,
+             variogram=None):
+    """returns the ``(w, ix)`` weights and neighbour indices of the target
+    points ``xi`` for the weighted sum methods, ``w`` is None for nearest"""
+    if method == 'nearest':
+        dist, ix = index.query(xi, distance_upper_bound=distance_upper_bound)
+        return None, ix
+    elif method == 'idw':
+        dist, ix = index.query(xi, k=nnear, eps=eps, distance_upper_bound=distance_upper_bound)
+        if np.isfinite(distance_upper_bound):
+            # neighbours beyond the bound get zero weight, point them at the nearest one so that they can be taken
+            ix = np.where(np.isinf(dist), ix[:, :1], ix)
+        with stage('interpolate.weights', len(xi)) as s:
+            if point_weights is not None:
+                # missing neighbours (index n) have zero weight anyway
+                point_weights = np.take(point_weights, ix, mode='clip')
+            w = _idw_weights(dist, power, threshold, point_weights).astype(index.dtype, copy=False)
+            s.nbytes = w.nbytes
+        return w, ix
+    elif method == 'kriging':
+        w, ix, variance = _kriging(index, xi, nnear, eps, threshold, variogram, distance_upper_bound)
+        return w, ix
+    elif method == 'natural':
+        tri, circumcircles = index.triangulation, index.circumcircles
+        with stage('interpolate.weights', len(xi)) as s:
+            w, ix = _natural_weights(tri, circumcircles, index.metric(xi), threshold)
+            w, ix = _as_dtype(index, w, ix)
+            s.nbytes = w.nbytes + ix.nbytes
+        return w, ix
+    else:
+        tri = index.triangulation
+        with stage('interpolate.weights', len(xi)) as s:
+            w, ix = _barycentric_weights(tri, index.metric(xi))
+            w, ix = _as_dtype(index, w, ix)
+            s.nbytes = w.nbytes + ix.nbytes
+        return w, ix
+
+
+def _kriging(index, xi, nnear, eps, threshold, variogram=None, distance_upper_bound=np.inf):
+    """returns the ``(w, ix, variance)`` ordinary kriging weights, neighbour
+    indices and kriging variances of the target points ``xi``"""
+    if variogram is None:
+        variogram = index.variogram
+    dist, ix = index.query(xi, k=nnear, eps=eps, distance_upper_bound=distance_upper_bound)
+    missing = np.isinf(dist)
+    ix = np.where(missing, ix[:, :1], ix)
+    with stage('interpolate.weights', len(xi)) as s:
+        # neighbours relative to their target, so that single precision keeps its accuracy
+        neighbours = (index.take_tree_points(ix) - index.metric(np.atleast_2d(xi))[:, np.newaxis]).astype(index.dtype)
+        w, variance = _kriging_weights(neighbours, dist, variogram, threshold, missing)
+        s.nbytes = w.nbytes + variance.nbytes
+    return w, ix, variance
+
+
+def _kriging_block_size(block_size, nnear, dtype):
+    """returns the number of targets per kriging block, at most
+    ``block_size``. The temporaries of the stacked kriging systems peak at
+    about 7 ``(nnear + 1)**2`` floats per target. Blocks are capped so that
+    8 of them per target, leaving some headroom, stay below
+    ``_KRIGING_BLOCK_BYTES``."""
+    target_bytes = 8 * (nnear + 1)**2 * np.dtype(dtype).itemsize
+    return max(1, min(block_size, _KRIGING_BLOCK_BYTES // target_bytes))
+
+
+def _local_weights(index, xi, method, nnear, eps, threshold):
+    """returns the ``(w, ix)`` weights and neighbour indices of linear or
+    cubic interpolation on the triangulation of the ``nnear`` nearest
+    neighbours of each target. The interpolants are linear in the values, so
+    interpolating the identity matrix gives the weight of every neighbour.
+    """
+    dist, ix = index.query(xi, k=nnear, eps=eps)
+    w = np.zeros(ix.shape)
+    below_threshold = dist[:, 0] < threshold
+    w[below_threshold, 0] = 1.
+
+    interpolator_fn = _local_linear if method == 'linear' else _local_cubic
+    identity = np.eye(nnear)
+    xi = index.metric(xi)
+    for n in np.flatnonzero(~below_threshold):
+        w[n] = interpolator_fn(index.take_tree_points(ix[n]), identity, xi[n])
+
+    return w, ix
+
+
+def _as_dtype(index, w, ix):
+    """returns the weights and neighbour indices in the dtypes of the query pipeline of ``index``"""
+    if index.dtype == np.float32:
+        return w.astype(np.float32), ix.astype(np.int32 if index.n < 2**31 else np.intp)
+    return w, ix
+
+
+def _evaluate_weights(index, w, ix):
+    """returns the weighted sum of the neighbour values"""
+    with stage('interpolate.evaluate', len(ix)) as s:
+        values = index.take_values(ix[:, 0]) if w is None else _apply_weights(w, index.take_values(ix))
+        s.nbytes = values.nbytes
+    return values
+
+
+def _idw_weights(dist, power, threshold, point_weights=None):
+    """returns normalized inverse distance weights for an (n, nnear) array of
+    neighbour distances, optionally multiplied by the (n, nnear) declustering
+    weights of the neighbours. Rows whose nearest neighbour is closer than
+    ``threshold`` get all of their weight on that neighbour, rows whose
+    neighbours all have zero point weight fall back to plain idw.
+    """
+    below_threshold = dist[:, 0] < threshold
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1 / dist**power
+        if point_weights is not None:
+            weighted = w * point_weights
+    if point_weights is not None:
+        unweighted = np.sum(weighted, axis=1) == 0
+        weighted[unweighted] = w[unweighted]
+        w = weighted
+    w[below_threshold] = 0.
+    w[below_threshold, 0] = 1.
+    w /= w.sum(axis=1)[:, np.newaxis]
+
+    return w
+
+
+def _barycentric_weights(tri, xi):
+    """returns the barycentric weights and vertex indices, both of shape
+    (n, 3), of the simplices of ``tri`` containing each target point.
+    Targets outside the triangulation get NaN weights.
+    """
+    simplex = tri.find_simplex(xi)
+    outside = simplex == -1
+    simplex[outside] = 0
+
+    transform = tri.transform[simplex]
+    b = np.einsum('ijk,ik->ij', transform[:, :2], xi - transform[:, 2])
+    w = np.hstack((b, 1 - b.sum(axis=1)[:, np.newaxis]))
+    w[outside] = np.nan
+
+    return w, tri.simplices[simplex]
+
+
+def _natural_weights(tri, circumcircles, xi, threshold, degenerate=1e-8):
+    """returns the Sibson natural neighbour weights and neighbour indices,
+    both of shape (n, k) where k is the largest number of natural neighbours
+    of any target (rows are padded with zero weights). Targets outside the
+    triangulation get NaN weights, targets closer than ``threshold`` to a
+    point get all of their weight on that point.
+
+    The natural neighbours of a target are the vertices of the triangles
+    whose circumcircle contains it (the Bowyer-Watson cavity), which are
+    found for all targets at once by a breadth first search over the
+    triangle neighbours starting from the triangle containing the target.
+    The stolen areas are then summed over the cavity triangles with
+    Watson's signed area formula. This needs the circumcenters of the
+    target with every triangle edge, a target (almost) on the line through
+    an edge is moved into its triangle by ``degenerate`` times the edge
+    length and retried.
+
+    References
+    ----------
+    Watson, D. F. (1992) Contouring: A Guide to the Analysis and Display of
+    Spatial Data. Pergamon Press.
+    """
+    # circumcenters relative to the first vertex of their triangle
+    centers, radii2 = circumcircles
+    n_simplices = len(tri.simplices)
+    simplex = tri.find_simplex(xi)
+    vertices = tri.simplices[np.maximum(simplex, 0)]
+    dist = np.linalg.norm(tri.points[vertices] - xi[:, np.newaxis], axis=2)
+    nearest = np.argmin(dist, axis=1)
+    below_threshold = (simplex != -1) & (dist[np.arange(len(xi)), nearest] < threshold)
+
+    # breadth first search of the cavities, as (target, triangle) pairs
+    target = np.flatnonzero((simplex != -1) & ~below_threshold)
+    triangle = simplex[target]
+    visited = target * n_simplices + triangle
+    frontier = visited
+    while len(frontier):
+        neighbors = tri.neighbors[frontier % n_simplices].ravel()
+        neighbor_target = np.repeat(frontier // n_simplices, 3)
+        keep = neighbors != -1
+        neighbors, neighbor_target = neighbors[keep], neighbor_target[keep]
+        offset = xi[neighbor_target] - tri.points[tri.simplices[neighbors, 0]]
+        in_circle = np.sum((offset - centers[neighbors])**2, axis=1) < radii2[neighbors]
+        frontier = np.unique(neighbor_target[in_circle] * n_simplices + neighbors[in_circle])
+        frontier = frontier[~np.isin(frontier, visited)]
+        visited = np.concatenate((visited, frontier))
+    target, triangle = visited // n_simplices, visited % n_simplices
+
+    # Watson's formula with coordinates relative to the target
+    p = tri.points[tri.simplices[triangle]] - xi[target, np.newaxis]
+    c = p[:, 0] + centers[triangle]
+    u, v = np.roll(p, -1, axis=1), np.roll(p, -2, axis=1)
+    cross = u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+    shift = np.abs(cross) < degenerate * np.sum((u - v)**2, axis=2)
+    if np.any(shift):
+        # retry the targets (almost) on an edge line moved slightly towards
+        # the centroid of their triangle, so they stay inside it
+        retry = np.unique(target[np.any(shift, axis=1)])
+        edge = np.sqrt(np.max(np.sum((u - v)**2, axis=2)[np.any(shift, axis=1)]))
+        towards = tri.points[vertices[retry]].mean(axis=1) - xi[retry]
+        xi = xi.copy()
+        xi[retry] += degenerate * edge * towards / np.linalg.norm(towards, axis=1)[:, np.newaxis]
+        return _natural_weights(tri, circumcircles, xi, threshold, degenerate)
+
+    # circumcenters of the target with the edge opposite each vertex
+    u2, v2 = np.sum(u**2, axis=2), np.sum(v**2, axis=2)
+    g = np.stack((v[..., 1] * u2 - u[..., 1] * v2, u[..., 0] * v2 - v[..., 0] * u2), axis=2)
+    g /= 2 * cross[..., np.newaxis]
+    g1, g2 = np.roll(g, -1, axis=1) - c[:, np.newaxis], np.roll(g, -2, axis=1) - c[:, np.newaxis]
+    area = g1[..., 0] * g2[..., 1] - g1[..., 1] * g2[..., 0]
+    e1, e2 = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]
+    area *= np.sign(e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0])[:, np.newaxis]
+
+    # sum the stolen areas per (target, natural neighbour)
+    n_points = len(tri.points)
+    key, inverse = np.unique(np.repeat(target, 3) * n_points + tri.simplices[triangle].ravel(), return_inverse=True)
+    stolen = np.bincount(inverse.ravel(), weights=area.ravel())
+    key_target = key // n_points
+    counts = np.bincount(key_target, minlength=len(xi))
+    position = np.arange(len(key)) - (np.cumsum(counts) - counts)[key_target]
+
+    k = max(1, counts.max(initial=0))
+    w = np.zeros((len(xi), k))
+    ix = np.zeros((len(xi), k), dtype=int)
+    w[key_target, position] = stolen
+    ix[key_target, position] = key % n_points
+    with np.errstate(invalid='ignore'):
+        w /= w.sum(axis=1)[:, np.newaxis]
+
+    w[below_threshold] = 0.
+    w[below_threshold, 0] = 1.
+    ix[below_threshold, 0] = vertices[below_threshold, nearest[below_threshold]]
+    w[simplex == -1] = np.nan
+
+    return w, ix
+
+
+def _concatenate_weights(blocks):
+    """concatenates the ``(w, ix)`` weights of several blocks of targets,
+    padding rows with zero weights where the blocks differ in width"""
+    k = max(w.shape[1] for w, ix in blocks)
+    w = np.concatenate([np.pad(w, ((0, 0), (0, k - w.shape[1]))) for w, ix in blocks])
+    ix = np.concatenate([np.pad(ix, ((0, 0), (0, k - ix.shape[1]))) for w, ix in blocks])
+    return w, ix
+
 
-    def _linear(self, dist, ix, n_interp, xi):
-        return LinearNDInterpolator(self.points[ix], self.values[ix])(np.array([xi[n_interp]]))
-        
-    def _nearest(self, xi):
-        dist, ix = self.tree.query(xi)
-        return self.values[ix,]
+def _apply_weights(w, values):
+    """returns the weighted sum of the neighbour ``values`` (n, k, ...) for
+    each row of the (n, k) weights. Works for scalar and vector valued
+    ``values``.
+    """
+    return np.einsum('ij,ij...->i...', w, values)
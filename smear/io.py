@@ -0,0 +1,61 @@
+"""
+module for reading scatter data from and writing rasters to disk without loading them into memory
+"""
+import numpy as np
+
+
+def read_npy(path):
+    """returns a read only memory mapped view of the array stored in the
+    .npy file ``path``. Only the pages that are touched are read from
+    disk, so it can be passed to ``Interpolator`` as ``points`` or
+    ``values`` regardless of its size.
+    """
+    return np.load(path, mmap_mode='r')
+
+
+def read_xyz(path, dtype='<f8'):
+    """returns ``(points, values)`` read only memory mapped views of a plain
+    binary xyz file, i.e. consecutive records of three ``dtype`` numbers
+    x, y, z with no header.
+
+    ``points`` is a strided view, ``Interpolator`` (cKDTree) copies
+    non-contiguous points into memory. Use ``xyz_to_npy`` to convert large
+    files once into contiguous .npy files that can be used without a copy.
+    """
+    xyz = np.memmap(path, dtype=dtype, mode='r')
+    if xyz.size % 3:
+        raise ValueError("Size of %s is not a multiple of three %s values" % (path, np.dtype(dtype).name))
+
+    xyz = xyz.reshape((-1, 3))
+    return xyz[:, :2], xyz[:, 2]
+
+
+def xyz_to_npy(xyz_path, points_path, values_path, dtype='<f8', chunk_size=2**20, values_dtype=np.float64):
+    """convert a plain binary xyz file into a float64 (n, 2) points .npy file
+    and a ``values_dtype`` (n,) values .npy file, ``chunk_size`` records at
+    a time. Write float32 values for an ``Interpolator`` with
+    ``precision='single'`` to memory map them without a copy. Returns
+    memory mapped views of the new files (see ``read_npy``).
+    """
+    points, values = read_xyz(xyz_path, dtype)
+    points_out = np.lib.format.open_memmap(points_path, mode='w+', dtype=np.float64, shape=points.shape)
+    values_out = np.lib.format.open_memmap(values_path, mode='w+', dtype=values_dtype, shape=values.shape)
+
+    for start in range(0, len(points), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        points_out[chunk] = points[chunk]
+        values_out[chunk] = values[chunk]
+
+    points_out.flush()
+    values_out.flush()
+    del points_out, values_out
+
+    return read_npy(points_path), read_npy(values_path)
+
+
+def open_raster(path, shape, dtype=np.float64):
+    """create a memory mapped .npy file of the given shape to be passed as
+    ``out`` to ``smear.grid``, which then writes the raster to disk tile by
+    tile without ever holding all of it in memory.
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
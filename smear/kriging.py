@@ -0,0 +1,137 @@
+"""
+module for fitting variograms and computing ordinary kriging weights for blocks of targets at once
+"""
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.spatial.distance import pdist
+
+
+class Variogram:
+    """Bounded semivariogram model ``nugget + sill * f(h / range)`` for
+    distances ``h`` > 0, with 'spherical', 'exponential' or 'gaussian'
+    ``f``. The semivariance at zero distance is 0.
+    """
+    def __init__(self, model, nugget, sill, range):
+        if model not in _MODELS:
+            raise ValueError("Unknown variogram model %s, expected one of %s." % (model, ', '.join(sorted(_MODELS))))
+        self.model = model
+        self.nugget = float(nugget)
+        self.sill = float(sill)
+        self.range = float(range)
+
+    def __repr__(self):
+        return 'Variogram(%r, nugget=%g, sill=%g, range=%g)' % (self.model, self.nugget, self.sill, self.range)
+
+    @property
+    def params(self):
+        return (self.model, self.nugget, self.sill, self.range)
+
+    def __call__(self, h):
+        """semivariance at the distances ``h``"""
+        gamma = self.nugget + self.sill * _MODELS[self.model](np.asarray(h) / self.range)
+        return np.where(np.asarray(h) > 0, gamma, 0.)
+
+    def covariance(self, h):
+        """covariance at the distances ``h``, i.e. the total sill minus the
+        semivariance"""
+        return self.nugget + self.sill - self(h)
+
+
+def fit_variogram(points, values, model='spherical', n_lags=20, max_lag=None, sample_size=1000, seed=0):
+    """Fit a ``Variogram`` to a random subsample of ``sample_size`` of the
+    points, so the cost does not depend on the number of points.
+
+    The empirical semivariance of all pairs of the subsample is binned into
+    ``n_lags`` distance classes up to ``max_lag`` (by default half the
+    diagonal of the bounding box of the subsample) and the model is fitted
+    by least squares weighted by the number of pairs in each class.
+    """
+    points = np.asarray(points)
+    values = np.asarray(values)
+    if values.ndim > 1:
+        values = values[:, 0]
+    if len(points) > sample_size:
+        sample = np.random.default_rng(seed).choice(len(points), sample_size, replace=False)
+        points, values = points[sample], values[sample]
+
+    h = pdist(points)
+    semivariance = pdist(values[:, np.newaxis], 'sqeuclidean') / 2
+    if max_lag is None:
+        max_lag = np.hypot(*np.ptp(points, axis=0)) / 2
+
+    lag = np.minimum((h / max_lag * n_lags).astype(int), n_lags)
+    counts = np.bincount(lag, minlength=n_lags + 1)[:n_lags]
+    used = counts > 0
+    if used.sum() < 3:
+        raise ValueError("Found %d distance classes with pairs of points, need at least 3 to fit a variogram"
+                         % (used.sum()))
+    lags = (np.bincount(lag, weights=h, minlength=n_lags + 1)[:n_lags][used] / counts[used])
+    gamma = np.bincount(lag, weights=semivariance, minlength=n_lags + 1)[:n_lags][used] / counts[used]
+
+    f = _MODELS[model]
+    fit = lambda h, nugget, sill, range: nugget + sill * f(h / range)
+    variance = max(np.var(values), np.finfo(float).tiny)
+    params, _ = curve_fit(fit, lags, gamma, p0=(0., variance, max_lag / 3), sigma=1 / np.sqrt(counts[used]),
+                          bounds=([0., 0., max_lag / n_lags / 10], [np.inf, np.inf, np.inf]))
+
+    return Variogram(model, *params)
+
+
+#---------------------------------------------------------------------------
+# internal functions
+#---------------------------------------------------------------------------
+def _spherical(r):
+    r = np.minimum(r, 1.)
+    return 1.5 * r - 0.5 * r**3
+
+
+def _exponential(r):
+    return 1. - np.exp(-3. * r)
+
+
+def _gaussian(r):
+    return 1. - np.exp(-3. * r**2)
+
+
+_MODELS = {'spherical': _spherical, 'exponential': _exponential, 'gaussian': _gaussian}
+
+
+def _kriging_weights(neighbours, dist, variogram, threshold, missing=None):
+    """returns the (m, k) ordinary kriging weights and the (m,) kriging
+    variances of m targets from their ``neighbours`` (m, k, 2) at distances
+    ``dist`` (m, k), in the dtype of ``neighbours``. The (k + 1) x (k + 1)
+    kriging systems of all targets are built as one stacked array and
+    solved with a single batched ``np.linalg.solve``. ``missing`` (m, k)
+    marks neighbours that must get zero weight, targets closer than
+    ``threshold`` to their first neighbour get all of their weight on it.
+    """
+    m, k = dist.shape
+    below_threshold = dist[:, 0] < threshold
+    total_sill = variogram.nugget + variogram.sill
+
+    A = np.ones((m, k + 1, k + 1), dtype=neighbours.dtype)
+    A[:, :k, :k] = variogram.covariance(np.linalg.norm(neighbours[:, :, np.newaxis] - neighbours[:, np.newaxis],
+                                                       axis=3))
+    A[:, k, k] = 0.
+    # a tiny nugget on the diagonal keeps the systems of duplicated points solvable
+    A[:, np.arange(k), np.arange(k)] += (1e-10 if A.dtype == np.float64 else 1e-6) * total_sill
+    b = np.ones((m, k + 1), dtype=neighbours.dtype)
+    b[:, :k] = variogram.covariance(dist)
+
+    if missing is not None and np.any(missing):
+        # decouple the missing neighbours: a unit row and column with a zero right hand side
+        row, col = np.nonzero(missing)
+        A[row, col, :] = 0.
+        A[row, :, col] = 0.
+        A[row, col, col] = 1.
+        b[row, col] = 0.
+
+    solution = np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    w = solution[:, :k]
+    variance = total_sill - np.sum(w * b[:, :k], axis=1) - solution[:, k]
+
+    w[below_threshold] = 0.
+    w[below_threshold, 0] = 1.
+    variance[below_threshold] = 0.
+
+    return w, np.maximum(variance, 0.)
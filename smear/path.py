@@ -3,88 +3,206 @@ module for cleaning up paths, i.e. boat/vehicle tracks etc
 """
 import numpy as np
 
+from .instrument import instrumented
+from .transform import reproject
+
 # function for 1D interpolation of a curved line or boat track.
+@instrumented('path.densify_path')
 def densify_path(path, spacing, values=None):
     """
     returns a new path with evenly spaced points <= spacing
     distance between the original set of points. It does not move
-    existing points. path and values should be (n, 2) numpy arrays.
-    Points are linearly interpolated between existing points. path 
-    is an ordered set of xy points.
+    existing points. path is an (n, 2) numpy array, an ordered set of
+    xy points. Points are linearly interpolated between existing points.
+
+    values is an optional (n,) or (n, k) array of values at the points,
+    e.g. depth and backscatter, which are interpolated linearly along the
+    distance travelled. Then a tuple (dense_path, dense_values) is returned.
+
+    The number of points inserted in every gap is computed up front and
+    the output is filled in a single vectorized pass, so the run time is
+    linear in the length of the dense path.
     """
 
-    if path.shape[1]!=2:
+    if path.ndim != 2 or path.shape[1]!=2:
         raise ValueError("Found path array with shape %s. Expected shape (n, 2)"
                              % (str(path.shape)))
 
     if values is not None:
+        values = np.asarray(values)
         if len(values)!=len(path):
             raise  ValueError("Length of path and values arrays must match")
 
-    # make a copy for output
-    dense_path = path[:]
-
-    # calculate distances.. each element of this np array is the
-    # distance from the point in xy to the next point
-    distances = np.sqrt(np.sum(np.square(path[:-1] - path[1:]), axis=1))
-
-    # get a np array of indices where distance are greater than
-    # spacing. We'll use this for masking.
-    where_to_interp = np.where(distances > spacing)[0]
-
-    # keep track of the offset (for inserting into our output array)
-    insert_offset = 0
-
-    # keep track of the indexes to values in xy_out that have been
-    # inserted
-    inserted_dense_path = []
-
-    for start, end, distance, xy_where in zip(path[where_to_interp],
-                                              path[where_to_interp + 1],
-                                              distances[where_to_interp],
-                                              where_to_interp + 1):
-        num_steps = int(distance / spacing + 1)
-        interp_points = np.vstack([np.linspace(start[0], end[0], num_steps),
-                                   np.linspace(start[1], end[1], num_steps)]).T
-        insert_point = xy_where + insert_offset
-        dense_path = np.vstack([dense_path[:insert_point], interp_points[1:-1],
-                            dense_path[insert_point:]])
-
-        # keep track of the indexes of values that were inserted
-        inserted_dense_path.extend(xrange(insert_point, insert_point + len(interp_points) - 2))
-
-        # increment the offset by the amount we just inserted
-        insert_offset += len(interp_points[1:-1])
+    # each dense point is path[segment] + t * (path[segment + 1] - path[segment])
+    segment, t = _densify_segments(path, spacing)
+    dense_path = _interp_segments(path, segment, t)
 
     if values is None:
         return dense_path
-    else:
-        # indexes of all values in dense_path
-        p1 = np.arange(len(dense_path))
 
-        # indexes of values that have not been inserted into dense_path
-        p = np.setdiff1d(p1, inserted_dense_path)
-        
-        # interpolate values values
-        interpolated_values = interp1d(p,z)(p1)
-        return (xy_out.T[0], xy_out.T[1], interpolated_values)
+    return dense_path, _interp_segments(values, segment, t)
 
 
-def interpolate_duplicated_gps(path):
+@instrumented('path.interpolate_duplicated_gps')
+def interpolate_duplicated_gps(path, times=None, max_gap=None):
     """
     correct duplicated gps coordinates caused by gps transceiver updates being slower than sounder pings 
     by linear interpolation between successive changed gps coordinates. This function should be run *after* 
     any boat path/gps signal loss corrections. The inherent assumption being that the vehicle speed does not
     change significantly between successive transceiver updates. path is an ordered set of xy points of shape 
     (n, 2)
+
+    By default x and y are interpolated separately by ping index. With
+    times, the (n,) non decreasing ping timestamps, a fix is a ping whose
+    (x, y) pair differs from the previous ping, and both coordinates are
+    interpolated between fixes by time, which places pings correctly for
+    uneven ping rates. With max_gap (in the units of times, or pings when
+    times is None) a tuple (path, dropouts) is returned, where dropouts is
+    a boolean mask of the pings that lie in a gap of more than max_gap
+    between fixes (or after the last fix), i.e. a GPS dropout. max_gap
+    does not change the interpolated path.
     """
 
-    x_interp = _interp_between_duplicates(path[:,0])
-    y_interp = _interp_between_duplicates(path[:,1])
+    if times is None and max_gap is None:
+        x_interp = _interp_between_duplicates(path[:,0])
+        y_interp = _interp_between_duplicates(path[:,1])
+
+        return np.vstack((x_interp, y_interp)).T
+
+    if times is not None:
+        times = np.asarray(times, dtype=float)
+        if times.shape != (len(path),):
+            raise ValueError("Found times array with shape %s. Expected shape (%d,)" % (str(times.shape), len(path)))
+        if np.any(times[1:] < times[:-1]):
+            raise ValueError("Ping times must be non decreasing")
+
+    if not len(path):
+        interpolated = np.zeros((0, 2))
+        return interpolated if max_gap is None else (interpolated, np.zeros(0, dtype=bool))
+
+    # fixes are the first ping and every ping where either coordinate changed
+    fixes = np.concatenate(([0], np.nonzero(np.any(path[1:] != path[:-1], axis=1))[0] + 1))
+    if times is None:
+        # the dropouts are counted in pings, the path is interpolated as without max_gap
+        times = np.arange(len(path), dtype=float)
+        fix_times = times[fixes]
+        interpolated = np.vstack((_interp_between_duplicates(path[:,0]), _interp_between_duplicates(path[:,1]))).T
+    else:
+        fix_times = times[fixes]
+        interpolated = np.empty((len(path), 2))
+        interpolated[:, 0] = np.interp(times, fix_times, path[fixes, 0])
+        interpolated[:, 1] = np.interp(times, fix_times, path[fixes, 1])
+
+        if max_gap is None:
+            return interpolated
 
-    return np.vstack((x_interp, y_interp)).T
+    # the last run lasts until the last ping
+    gaps = np.append(np.diff(fix_times), times[-1] - fix_times[-1])
+    dropouts = np.repeat(gaps > max_gap, np.diff(np.append(fixes, len(path))))
+    return interpolated, dropouts
     
 
+def interpolate_duplicated_gps_chunks(chunks):
+    """
+    streaming version of interpolate_duplicated_gps. chunks is an iterable
+    of (k, 2) path arrays, or of (path, values) tuples whose values are
+    passed through, and consecutive chunks form a single track. Yields
+    chunks of the same form with output identical to the batch function.
+
+    A run of duplicates can only be finished once the next distinct fix
+    arrives, so only the rows since the last fix of each coordinate are
+    held back; memory does not depend on the length of the track.
+    """
+    tails = [np.zeros(0), np.zeros(0)]
+    done = [np.zeros(0), np.zeros(0)]
+    held = None
+    is_tuple = False
+    for chunk in chunks:
+        path, values, is_tuple = _split_chunk(chunk)
+        for c in range(2):
+            x = np.concatenate((tails[c], path[:, c]))
+            start = _last_run_start(x)
+            done[c] = np.concatenate((done[c], _interp_runs(x, start)))
+            tails[c] = x[start:]
+
+        held = _append_rows(held, values)
+        ready = min(len(done[0]), len(done[1]))
+        if ready:
+            yield _join_chunk(_take_ready(done, ready), _pop_rows(held, ready), is_tuple)
+            held = _drop_rows(held, ready)
+
+    # the trailing runs have no next fix and are kept as they are
+    if len(done[0]) + len(tails[0]):
+        for c in range(2):
+            done[c] = np.concatenate((done[c], tails[c]))
+        yield _join_chunk(_take_ready(done, len(done[0])), held, is_tuple)
+
+
+def densify_path_chunks(chunks, spacing):
+    """
+    streaming version of densify_path. chunks is an iterable of (k, 2)
+    path arrays, or of (path, values) tuples, and consecutive chunks form a
+    single track. Yields densified chunks of the same form with output
+    identical to the batch function. Only the last point of the previous
+    chunk is kept to fill the gap across the chunk boundary.
+    """
+    last = None
+    for chunk in chunks:
+        path, values, is_tuple = _split_chunk(chunk)
+        if not len(path):
+            continue
+
+        first = last is None
+        if not first:
+            path = np.concatenate((last[0], path))
+            if values is not None:
+                values = np.concatenate((last[1], values))
+
+        last = (path[-1:], None if values is None else values[-1:])
+        if values is None:
+            dense_path, dense_values = densify_path(path, spacing), None
+        else:
+            dense_path, dense_values = densify_path(path, spacing, values)
+
+        # the first point was already yielded with the previous chunk
+        skip = 0 if first else 1
+        yield _join_chunk(dense_path[skip:], None if dense_values is None else dense_values[skip:], is_tuple)
+
+
+def clean_track_chunks(chunks, duplicated_gps=True, spacing=None, src_crs=None, dst_crs=None,
+                       coordinate_system=None):
+    """
+    streaming pipeline for raw GPS/sounder logs. chunks is an iterable of
+    (k, 2) path arrays, or of (path, values) tuples, e.g. pings read from a
+    log a block at a time. Each enabled stage is applied in turn:
+
+    - duplicated_gps: interpolate_duplicated_gps_chunks
+    - src_crs, dst_crs: reproject the path (see smear.transform.reproject),
+      both must be given
+    - spacing: densify_path_chunks with this spacing, in the units of
+      dst_crs when the path is reprojected
+    - coordinate_system: transform the path to (s, n) coordinates with an
+      SN_CoordinateSystem
+
+    Chunks are yielded as they are ready with constant memory.
+    """
+    if (src_crs is None) != (dst_crs is None):
+        raise ValueError("Reprojecting the path needs both src_crs and dst_crs, found %s and %s"
+                         % (src_crs, dst_crs))
+
+    if duplicated_gps:
+        chunks = interpolate_duplicated_gps_chunks(chunks)
+    if src_crs is not None:
+        chunks = _map_path(chunks, lambda path: reproject(path, src_crs, dst_crs))
+    if spacing is not None:
+        chunks = densify_path_chunks(chunks, spacing)
+    if coordinate_system is not None:
+        chunks = _map_path(chunks, lambda path: np.column_stack(
+            coordinate_system.transform_xy_to_sn(path[:, 0], path[:, 1])))
+
+    return chunks
+
+
 def _interp_between_duplicates(x):  
     """
     replaces an array with duplicate values with new array of same size that replaces the duplicates with 
@@ -110,8 +228,100 @@ def _interp_between_duplicates(x):
     #idx = np.argsort(xUniqueIndices)
     #return np.interp(np.arange(len(x)), xUniqueIndices[idx], xUnique[idx])
 
-    xtmp = x.copy()
-    xtmp[1:] = x[1:] - x[:-1]
-    x_idx = np.nonzero(xtmp)[0]
-    x_vals = x[x_idx]
-    return np.interp(np.arange(len(x)),x_idx, x_vals)
\ No newline at end of file
+    return _interp_runs(x, len(x))
+
+
+def _interp_runs(x, stop):
+    """
+    returns the rows [0, stop) of _interp_between_duplicates(x), the first
+    value of x always starts a run. Only rows before the start of the last
+    run depend on the rows that follow x.
+    """
+    x_idx = np.concatenate(([0], np.nonzero(x[1:] != x[:-1])[0] + 1))
+    return np.interp(np.arange(stop), x_idx, x[x_idx])
+
+
+def _last_run_start(x):
+    """returns the index of the first value of the last run of duplicates in x"""
+    changes = np.nonzero(x[1:] != x[:-1])[0]
+    return changes[-1] + 1 if len(changes) else 0
+
+
+def _densify_segments(path, spacing):
+    """
+    returns the segment index and the fraction along the segment of every
+    point of the densified path. A gap of length d longer than spacing is
+    split into ceil(d / spacing) steps, so no step is longer than spacing.
+    """
+    n = len(path)
+    if n < 2:
+        return np.zeros(n, dtype=int), np.zeros(n)
+
+    # distance from each point in path to the next point
+    distances = np.sqrt(np.sum(np.square(path[:-1] - path[1:]), axis=1))
+    steps = np.where(distances > spacing, np.ceil(distances / spacing), 1).astype(int)
+
+    # every segment contributes its first point and the points inserted after it
+    first = np.cumsum(steps) - steps
+    segment = np.repeat(np.arange(n - 1), steps)
+    t = (np.arange(len(segment)) - first[segment]) / steps[segment]
+
+    # the last point ends the last segment
+    return np.append(segment, n - 2), np.append(t, 1.)
+
+
+def _interp_segments(a, segment, t):
+    """interpolate the rows of ``a`` at the fraction ``t`` along ``segment``"""
+    if len(a) < 2:
+        return np.array(a, dtype=float)
+
+    t = t.reshape(t.shape + (1,) * (a.ndim - 1))
+    start = a[segment]
+    out = np.subtract(a[segment + 1], start, dtype=float)
+    out *= t
+    out += start
+    # existing points are not moved, including the last one
+    out[-1] = a[-1]
+    return out
+
+
+
+def _split_chunk(chunk):
+    """returns the path, the values (or None) and whether the stream holds
+    (path, values) tuples"""
+    if isinstance(chunk, tuple):
+        path, values = chunk
+        return np.asarray(path, dtype=float), np.asarray(values), True
+    return np.asarray(chunk, dtype=float), None, False
+
+
+def _join_chunk(path, values, is_tuple):
+    return (path, values) if is_tuple else path
+
+
+def _map_path(chunks, fn):
+    for chunk in chunks:
+        path, values, is_tuple = _split_chunk(chunk)
+        yield _join_chunk(fn(path), values, is_tuple)
+
+
+def _take_ready(done, ready):
+    """returns the first ``ready`` rows of both coordinates, keeping the rest in done"""
+    path = np.column_stack((done[0][:ready], done[1][:ready]))
+    done[0] = done[0][ready:]
+    done[1] = done[1][ready:]
+    return path
+
+
+def _append_rows(held, values):
+    if values is None:
+        return held
+    return values if held is None else np.concatenate((held, values))
+
+
+def _pop_rows(held, n):
+    return None if held is None else held[:n]
+
+
+def _drop_rows(held, n):
+    return None if held is None else held[n:]
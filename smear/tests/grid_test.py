@@ -0,0 +1,154 @@
+import numpy as np
+import numpy.testing as npt
+from smear.interpolate import Interpolator
+from smear.grid import grid, dirty_tiles
+from smear.transform import reproject
+
+def _grid_reference(fn, x, y, **kwargs):
+	xx, yy = np.meshgrid(x, y)
+	xi = np.vstack((xx.ravel(), yy.ravel())).T
+	return fn(xi, **kwargs).reshape(len(y), len(x))
+
+def test_grid_matches_untiled():
+	points = np.random.random((500,2))*100
+	values = np.random.random(500)*100
+	x = np.linspace(0, 100, 37)
+	y = np.linspace(0, 100, 23)
+
+	fn = Interpolator(points, values)
+	for method in ('nearest', 'idw', 'linear', 'cubic', 'natural'):
+		vi_target = _grid_reference(fn, x, y, method=method)
+		npt.assert_almost_equal(grid(fn, x, y, method=method, tile_size=8), vi_target)
+		npt.assert_almost_equal(grid(fn, x, y, method=method, tile_size=8, workers=2), vi_target)
+
+def test_grid_process_pool():
+	points = np.random.random((500,2))*100
+	values = np.random.random(500)*100
+	x = np.linspace(0, 100, 37)
+	y = np.linspace(0, 100, 23)
+
+	fn = Interpolator(points, values)
+	for method, kwargs in (('nearest', {}), ('idw', {'nnear': 8}), ('linear', {}), ('natural', {}),
+			('linear', {'nnear': 10, 'triangulation': 'local'})):
+		vi_target = _grid_reference(fn, x, y, method=method, **kwargs)
+		vi = grid(fn, x, y, method=method, tile_size=8, workers=2, executor='process', **kwargs)
+		npt.assert_almost_equal(vi, vi_target)
+
+	# the halo tiles are interpolated in the precision of the interpolator
+	fn = Interpolator(points, values, leafsize=4, precision='single')
+	vi_target = _grid_reference(fn, x, y, method='idw')
+	vi = grid(fn, x, y, method='idw', tile_size=8, workers=2, executor='process')
+	assert vi.dtype == np.float32
+	npt.assert_array_equal(vi, vi_target)
+
+def test_grid_out():
+	points = np.random.random((100,2))
+	values = np.random.random((100,2))
+	x = np.linspace(0, 1, 10)
+	y = np.linspace(0, 1, 5)
+
+	fn = Interpolator(points, values)
+	out = np.zeros((5, 10, 2))
+	assert grid(fn, x, y, method='idw', out=out) is out
+	npt.assert_almost_equal(out[:,:,1], _grid_reference(Interpolator(points, values[:,1]), x, y, method='idw'))
+	npt.assert_raises(ValueError, grid, fn, x, y, out=np.zeros((10, 5, 2)))
+
+def test_grid_channels():
+	points = np.random.random((100,2))
+	depth = np.random.random(100)
+	x = np.linspace(0, 1, 10)
+	y = np.linspace(0, 1, 5)
+
+	vi = grid(Interpolator(points, {'depth': depth, 'time': depth * 2}), x, y, method='idw', tile_size=4)
+	npt.assert_almost_equal(vi['depth'], _grid_reference(Interpolator(points, depth), x, y, method='idw'))
+	npt.assert_almost_equal(vi['time'], 2 * vi['depth'])
+
+def test_dirty_tiles():
+	points = np.random.random((2000,2))*100
+	values = np.random.random(2000)
+	x = np.linspace(0, 100, 40)
+	y = np.linspace(0, 100, 40)
+
+	fn = Interpolator(points, values)
+	before = grid(fn, x, y, method='idw')
+	assert dirty_tiles(fn, x, y, tile_size=10) == []
+
+	fn.add_points([[5., 5.]], [100.])
+	fn.remove_points(points[-1])
+	tiles = dirty_tiles(fn, x, y, tile_size=10)
+	assert 0 < len(tiles) < 16
+	assert dirty_tiles(fn, x, y, tile_size=10) == []
+
+	after = grid(fn, x, y, method='idw')
+	changed = np.zeros(after.shape, dtype=bool)
+	for rows, cols in tiles:
+		changed[rows, cols] = True
+	npt.assert_array_equal(after[~changed], before[~changed])
+
+def test_grid_anisotropy():
+	points = np.random.random((500,2))*100
+	values = np.random.random(500)*100
+	x = np.linspace(0, 100, 37)
+	y = np.linspace(0, 100, 23)
+
+	fn = Interpolator(points, values, anisotropy=(0.5, 3.))
+	vi_target = _grid_reference(fn, x, y, method='idw')
+	npt.assert_almost_equal(grid(fn, x, y, method='idw', tile_size=8, workers=2, executor='process'), vi_target)
+
+def test_grid_crs():
+	points = reproject(np.column_stack((np.random.random(500) - 99.5, np.random.random(500) + 29.5)),
+		'epsg:4326', 'epsg:32614')
+	values = np.random.random(500)*100
+	lon = np.linspace(-99.4, -98.6, 37)
+	lat = np.linspace(29.6, 30.4, 23)
+
+	fn = Interpolator(points, values, crs='epsg:32614')
+	xx, yy = np.meshgrid(lon, lat)
+	xi = reproject(np.vstack((xx.ravel(), yy.ravel())).T, 'epsg:4326', 'epsg:32614')
+	for method in ('nearest', 'idw', 'linear'):
+		vi_target = fn(xi, method=method).reshape(len(lat), len(lon))
+		npt.assert_almost_equal(grid(fn, lon, lat, method=method, tile_size=8, crs='epsg:4326'), vi_target)
+		npt.assert_almost_equal(grid(fn, lon, lat, method=method, tile_size=8, workers=2, executor='process',
+			crs='epsg:4326'), vi_target)
+
+def test_grid_max_distance(monkeypatch):
+	points = np.random.random((300,2))*20 + 40
+	values = np.random.random(300)
+	x = np.linspace(0, 100, 64)
+	y = np.linspace(0, 100, 48)
+
+	fn = Interpolator(points, values)
+	vi_target = _grid_reference(fn, x, y, method='idw', max_distance=3.)
+
+	interpolated = []
+	interpolate = fn._interpolate
+	monkeypatch.setattr(fn, '_interpolate', lambda xi, *args, **kwargs: interpolated.append(len(xi)) or
+			interpolate(xi, *args, **kwargs))
+	vi = grid(fn, x, y, method='idw', tile_size=8, max_distance=3.)
+	npt.assert_almost_equal(vi, vi_target)
+	assert np.isnan(vi).any() and not np.isnan(vi).all()
+	# empty tiles are never interpolated
+	assert len(interpolated) < len(range(0, 48, 8)) * len(range(0, 64, 8))
+
+def test_grid_max_distance_crs(monkeypatch):
+	# a survey patch in one corner of a lon/lat grid
+	points = reproject(np.column_stack((np.random.random(300)*0.1 - 99.4, np.random.random(300)*0.1 + 29.6)),
+		'epsg:4326', 'epsg:32614')
+	values = np.random.random(300)
+	lon = np.linspace(-99.45, -98.6, 64)
+	lat = np.linspace(29.55, 30.4, 48)
+
+	fn = Interpolator(points, values, crs='epsg:32614')
+	xx, yy = np.meshgrid(lon, lat)
+	xi = reproject(np.vstack((xx.ravel(), yy.ravel())).T, 'epsg:4326', 'epsg:32614')
+	vi_target = fn(xi, method='idw', max_distance=2000.).reshape(len(lat), len(lon))
+
+	interpolated = []
+	interpolate = fn._interpolate
+	monkeypatch.setattr(fn, '_interpolate', lambda xi, *args, **kwargs: interpolated.append(len(xi)) or
+			interpolate(xi, *args, **kwargs))
+	vi = grid(fn, lon, lat, method='idw', tile_size=8, max_distance=2000., crs='epsg:4326')
+	npt.assert_almost_equal(vi, vi_target)
+	assert np.isnan(vi).any() and not np.isnan(vi).all()
+	# empty tiles are never interpolated
+	assert len(interpolated) < len(range(0, 48, 8)) * len(range(0, 64, 8))
@@ -0,0 +1,42 @@
+import numpy as np
+from smear import Interpolator, Profile, add_hook, remove_hook, grid, densify_path, thiessen
+from smear.instrument import Stage
+
+def test_profile():
+	points = np.random.random((500,2))*100
+	values = np.random.random(500)
+	xi = np.random.random((100,2))*100
+
+	with Profile() as profile:
+		fn = Interpolator(points, values)
+		fn(xi, method='idw')
+		fn(xi[:10], method='linear', nnear=10, triangulation='local')
+		grid(fn, np.linspace(0, 100, 20), np.linspace(0, 100, 10), method='linear', tile_size=8)
+		densify_path(points[:10], 1.)
+		thiessen(points)
+
+	totals, calls = profile.totals()
+	for name in ('interpolate.build_tree', 'interpolate.query', 'interpolate.weights', 'interpolate.evaluate',
+			'interpolate.threshold', 'interpolate.local_triangulation', 'interpolate.triangulation', 'grid.tile',
+			'path.densify_path', 'thiessen.thiessen'):
+		assert name in totals
+	assert totals['interpolate.build_tree'].points == 500
+	assert calls['grid.tile'] == 6 and totals['grid.tile'].points == 200
+	assert totals['interpolate.weights'].nbytes > 0
+	assert all(stage.seconds >= 0 for stage in profile.stages)
+	assert 'interpolate.query' in profile.report()
+
+	# nothing is recorded outside the context
+	n = len(profile.stages)
+	fn(xi, method='idw')
+	assert len(profile.stages) == n
+
+def test_hooks():
+	stages = []
+	add_hook(stages.append)
+	try:
+		Interpolator(np.random.random((50,2)), np.random.random(50))(np.random.random((5,2)))
+	finally:
+		remove_hook(stages.append)
+	assert all(isinstance(stage, Stage) for stage in stages)
+	assert [stage.name for stage in stages] == ['interpolate.build_tree', 'interpolate.query', 'interpolate.evaluate']
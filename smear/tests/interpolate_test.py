@@ -1,7 +1,10 @@
 import numpy as np
 import numpy.testing as npt
 from scipy.interpolate import griddata
+from scipy.spatial import Voronoi
+import shapely
 from smear.interpolate import Interpolator
+from smear.transform import reproject
 
 def test_nearest():
 	points = np.random.random((100,2))
@@ -40,5 +43,409 @@ def test_linear():
 	vi = Interpolator(points, values)(xi, method='linear', nnear=10)
 	npt.assert_almost_equal(vi, vi_target)
 
+def test_natural():
+	points = np.random.random((300,2))*100
+	values = 2*points[:,0] - 3*points[:,1] + 5
+	xi = np.vstack((np.random.random((20,2))*40 + 30, points[:3], [[150., 50.]]))
+
+	fn = Interpolator(points, values)
+	vi = fn(xi, method='natural')
+	npt.assert_almost_equal(vi[:-1], 2*xi[:-1,0] - 3*xi[:-1,1] + 5)
+	npt.assert_array_equal(vi[-4:-1], values[:3])
+	assert np.isnan(vi[-1])
+
+	# sibson weights are the areas the target steals from the voronoi cells
+	def cell_areas(points):
+		voronoi = Voronoi(points)
+		return np.array([shapely.Polygon(voronoi.vertices[region]).area if -1 not in region else np.nan
+				for region in (voronoi.regions[r] for r in voronoi.point_region)])
+
+	W = fn.operator(xi[:5], method='natural').toarray()
+	areas = cell_areas(points)
+	for n, x in enumerate(xi[:5]):
+		new_areas = cell_areas(np.vstack((points, x)))
+		npt.assert_almost_equal(W[n], np.nan_to_num((areas - new_areas[:-1]) / new_areas[-1]))
+
+	# targets on the edges of a regular grid of points
+	x, y = np.meshgrid(np.arange(11.), np.arange(11.))
+	points = np.column_stack((x.ravel(), y.ravel()))
+	x, y = np.meshgrid(np.arange(0, 10.1, 0.5), np.arange(0, 10.1, 0.5))
+	xi = np.column_stack((x.ravel(), y.ravel()))
+	vi = Interpolator(points, 2*points[:,0] - 3*points[:,1])(xi, method='natural')
+	npt.assert_almost_equal(vi, 2*xi[:,0] - 3*xi[:,1], decimal=6)
+
+	# linear precision holds for projected coordinates far from their origin
+	points = np.random.random((2000,2))*1000 + [500000, 3300000]
+	xi = np.random.random((500,2))*800 + [500100, 3300100]
+	vi = Interpolator(points, 2*points[:,0] + 3*points[:,1])(xi, method='natural')
+	npt.assert_allclose(vi, 2*xi[:,0] + 3*xi[:,1], rtol=1e-12)
+
 def test_idw():
-	pass
+	points = np.random.random((100,2))*100
+	values = np.random.random(100)*100
+	xi = np.vstack((np.random.random((10,2))*100, points[:3]))
+
+	fn = Interpolator(points, values)
+	for power in (1, 2):
+		dist, ix = fn.tree.query(xi, k=6)
+		vi_target = np.array([values[i[0]] if d[0] < 1e-10 else fn._idw(d, i, n, xi, power=power)
+					for n, (d, i) in enumerate(zip(dist, ix))])
+
+		vi = fn(xi, method='idw', nnear=6, power=power)
+		npt.assert_almost_equal(vi, vi_target)
+
+		vi = fn(xi, method='idw', nnear=6, power=power, block_size=4)
+		npt.assert_almost_equal(vi, vi_target)
+
+def test_idw_vector_values():
+	points = np.random.random((100,2))*100
+	values = np.random.random((100,3))*100
+	xi = np.random.random((10,2))*100
+
+	fn = Interpolator(points, values)
+	vi = fn(xi, method='idw', nnear=8)
+	assert vi.shape == (10, 3)
+	for channel in range(3):
+		npt.assert_almost_equal(vi[:,channel], Interpolator(points, values[:,channel])(xi, method='idw', nnear=8))
+
+def test_local_triangulation():
+	points = np.random.random((100,2))*100
+	values = np.random.random(100)*100
+	xi = np.random.random((10,2))*50
+
+	fn = Interpolator(points, values)
+	# cubic gradients are estimated iteratively so only agree to the solver tolerance
+	for method, decimal in (('linear', 7), ('cubic', 4)):
+		vi_target = fn(xi, method=method)
+		vi = fn(xi, method=method, nnear=100, triangulation='local')
+		npt.assert_almost_equal(vi, vi_target, decimal=decimal)
+
+	npt.assert_raises(ValueError, fn, xi, method='linear', triangulation='tiled')
+
+def test_save_load(tmpdir):
+	points = np.random.random((200,2))*100
+	values = np.random.random(200)*100
+	xi = np.random.random((20,2))*100
+
+	for ellipsivity in (1., 2.):
+		fn = Interpolator(points, values, ellipsivity=ellipsivity)
+		fn.save(str(tmpdir.join('idw%s' % ellipsivity)))
+		fn(xi, method='linear')
+		fn.save(str(tmpdir.join('linear%s' % ellipsivity)))
+
+		loaded = Interpolator.load(str(tmpdir.join('idw%s' % ellipsivity)))
+		assert loaded._index._triangulation is None
+		npt.assert_array_equal(loaded(xi, method='idw'), fn(xi, method='idw'))
+
+		loaded = Interpolator.load(str(tmpdir.join('linear%s' % ellipsivity)))
+		assert loaded._index._triangulation is not None
+		# the tree data is only saved when it is not the points, and the triangulation shares it
+		assert tmpdir.join('linear%s' % ellipsivity, 'tree.1.npy').exists() == (ellipsivity != 1.)
+		assert not tmpdir.join('linear%s' % ellipsivity, 'triangulation.points.npy').exists()
+		npt.assert_array_equal(loaded.points, points)
+		for method in ('nearest', 'idw', 'linear', 'cubic'):
+			npt.assert_almost_equal(loaded(xi, method=method), fn(xi, method=method))
+
+def test_channels():
+	points = np.random.random((100,2))*100
+	depth = np.random.random(100)*100
+	backscatter = np.random.random(100)
+	xi = np.random.random((10,2))*100
+
+	fn = Interpolator(points, {'depth': depth, 'backscatter': backscatter})
+	stacked = Interpolator(points, np.column_stack((depth, backscatter)))
+	for method, kwargs in (('nearest', {}), ('idw', {}), ('linear', {}), ('cubic', {}),
+			('linear', {'nnear': 10, 'triangulation': 'local'})):
+		vi = fn(xi, method=method, **kwargs)
+		assert sorted(vi) == ['backscatter', 'depth']
+		npt.assert_almost_equal(vi['depth'], Interpolator(points, depth)(xi, method=method, **kwargs))
+		npt.assert_almost_equal(vi['backscatter'], Interpolator(points, backscatter)(xi, method=method, **kwargs))
+		npt.assert_almost_equal(stacked(xi, method=method, **kwargs)[:,1], vi['backscatter'])
+
+def test_add_remove_points():
+	points = np.random.random((300,2))*100
+	values = np.random.random(300)*100
+	xi = np.random.random((20,2))*100
+
+	fn = Interpolator(points[:200], values[:200], buffer_size=1000)
+	fn.add_points(points[200:], values[200:])
+	assert fn.remove_points(points[:50]) == 50
+	assert fn.remove_points(points[250:260]) == 10
+	assert fn.remove_points(points[:50]) == 0
+
+	keep = np.r_[50:250, 260:300]
+	target = Interpolator(points[keep], values[keep])
+	for method in ('nearest', 'idw'):
+		npt.assert_almost_equal(fn(xi, method=method), target(xi, method=method))
+	npt.assert_almost_equal(fn(xi, method='linear', nnear=10, triangulation='local'),
+			target(xi, method='linear', nnear=10, triangulation='local'))
+
+	fn.compact()
+	assert not fn._index.pending
+	assert len(fn.points) == len(keep)
+	npt.assert_almost_equal(fn(xi, method='idw'), target(xi, method='idw'))
+	npt.assert_almost_equal(fn(xi, method='linear'), target(xi, method='linear'))
+
+def test_background_compaction():
+	points = np.random.random((300,2))*100
+	values = np.random.random(300)*100
+	xi = np.random.random((20,2))*100
+
+	fn = Interpolator(points[:100], values[:100], buffer_size=10)
+	for start in range(100, 300, 20):
+		fn.add_points(points[start:start + 20], values[start:start + 20])
+		fn.remove_points(points[start - 5])
+	fn.compact()
+
+	keep = np.setdiff1d(np.arange(300), np.arange(95, 280, 20))
+	assert len(fn.points) == len(keep)
+	npt.assert_almost_equal(fn(xi, method='idw'), Interpolator(points[keep], values[keep])(xi, method='idw'))
+
+def test_weights_cache():
+	points = np.random.random((200,2))*100
+	values = np.random.random(200)*100
+	xi = np.random.random((50,2))*100
+
+	fn = Interpolator(points, values, cache_size=10**6)
+	target = Interpolator(points, values)
+	for method in ('nearest', 'idw', 'linear'):
+		npt.assert_almost_equal(fn(xi, method=method), target(xi, method=method))
+		npt.assert_almost_equal(fn(xi, method=method), target(xi, method=method))
+	assert fn.cache_info().hits == 3
+	assert fn.cache_info().misses == 3
+
+	# an empty target array is not cached
+	for method in ('nearest', 'idw', 'linear'):
+		assert fn(np.zeros((0,2)), method=method).shape == (0,)
+	assert fn.cache_info().entries == 3
+
+	# cached weights are reused for new values on the same points
+	fn.values = values * 2
+	npt.assert_almost_equal(fn(xi, method='idw'), 2 * target(xi, method='idw'))
+	assert fn.cache_info().hits == 4
+
+	# but not when the points change
+	fn.add_points([[50., 50.]], [0.])
+	fn(xi, method='idw', nnear=3)
+	fn(xi, method='idw')
+	assert fn.cache_info().hits == 4
+
+	# and entries are evicted least recently used first
+	fn = Interpolator(points, values, cache_size=2 * 50 * 6 * 16)
+	fn(xi, method='idw')
+	fn(xi + 1, method='idw')
+	fn(xi + 2, method='idw')
+	assert fn.cache_info().entries == 2
+	fn(xi + 2, method='idw')
+	fn(xi, method='idw')
+	assert fn.cache_info().hits == 1
+
+def test_idw_declustering_weights():
+	points = np.random.random((100,2))*100
+	values = np.random.random(100)*100
+	weights = np.random.random(100) + 0.5
+	xi = np.vstack((np.random.random((10,2))*100, points[:3]))
+
+	fn = Interpolator(points, values)
+	dist, ix = fn.tree.query(xi, k=6)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		w = weights[ix] / dist**2
+		vi_target = np.sum(w * values[ix], axis=1) / np.sum(w, axis=1)
+	vi_target[-3:] = values[:3]
+
+	npt.assert_almost_equal(fn(xi, method='idw', power=2, weights=weights), vi_target)
+	npt.assert_almost_equal(fn.operator(xi, method='idw', power=2, weights=weights) @ values, vi_target)
+
+	# the grid tiles sent to worker processes get the weights of their subset of the points
+	from smear.grid import grid
+	x = np.linspace(0, 100, 19)
+	y = np.linspace(0, 100, 13)
+	xx, yy = np.meshgrid(x, y)
+	vi_target = fn(np.column_stack((xx.ravel(), yy.ravel())), method='idw', weights=weights).reshape(len(y), len(x))
+	npt.assert_almost_equal(grid(fn, x, y, method='idw', weights=weights, tile_size=8, workers=2, executor='process'),
+			vi_target)
+
+	# zero weight neighbours fall back to plain idw
+	npt.assert_almost_equal(fn(xi, method='idw', weights=np.zeros(100)), fn(xi, method='idw'))
+
+	try:
+		fn(xi, method='linear', weights=weights)
+		assert False
+	except ValueError:
+		pass
+
+def test_operator():
+	points = np.random.random((200,2))*100
+	values = np.random.random((200,2))*100
+	xi = np.vstack((np.random.random((30,2))*100, points[:2]))
+
+	fn = Interpolator(points, values)
+	for method, kwargs in (('nearest', {}), ('idw', {'power': 2}), ('linear', {}),
+			('linear', {'nnear': 10, 'triangulation': 'local'})):
+		W = fn.operator(xi, method=method, **kwargs)
+		assert W.shape == (len(xi), len(points))
+		npt.assert_almost_equal(W @ values, fn(xi, method=method, **kwargs))
+
+	W = fn.operator(xi, method='cubic', nnear=10)
+	npt.assert_almost_equal(W @ values, fn(xi, method='cubic', nnear=10, triangulation='local'), decimal=3)
+
+	W = fn.operator(np.zeros((0,2)), method='idw')
+	assert W.shape == (0, len(points))
+	assert (W @ values).shape == (0, 2)
+
+def test_anisotropy():
+	points = np.random.random((200,2))*100
+	values = np.random.random(200)*100
+	xi = np.random.random((20,2))*100
+
+	# the target points are transformed the same way as the points
+	vi_target = Interpolator(points * [2., 1.], values)(xi * [2., 1.], method='idw')
+	npt.assert_almost_equal(Interpolator(points, values, ellipsivity=2.)(xi, method='idw'), vi_target)
+	npt.assert_almost_equal(Interpolator(points, values, anisotropy=(0., 0.5))(xi, method='idw'), vi_target)
+	npt.assert_almost_equal(Interpolator(points, values, anisotropy=[[2., 0.], [0., 1.]])(xi, method='idw'), vi_target)
+
+	# rotating everything by the anisotropy angle gives the same result
+	angle = 0.3
+	rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+	for method in ('idw', 'linear'):
+		vi_target = Interpolator(points, values, anisotropy=(0., 4.))(xi, method=method)
+		vi = Interpolator(points.dot(rotation.T), values, anisotropy=(angle, 4.))(xi.dot(rotation.T), method=method)
+		npt.assert_almost_equal(vi, vi_target)
+
+def test_save_load_metric(tmpdir):
+	import json, os
+	from smear.transform import SN_CoordinateSystem
+	points = np.random.random((100,2))*100
+	values = np.random.random(100)*100
+	xi = np.random.random((10,2))*80 + 10
+
+	t = np.linspace(0, 100, 50)
+	coordinate_system = SN_CoordinateSystem(t, 10 * np.sin(t / 20))
+	for name, kwargs in (('matrix', {'anisotropy': [[2., 0.], [0.5, 1.]]}), ('ratio', {'anisotropy': (0.3, 4.)}),
+			('along_s', {'anisotropy': (0., lambda s: 1. + s / 50), 'coordinate_system': coordinate_system})):
+		fn = Interpolator(points, values, **kwargs)
+		path = str(tmpdir.join(name))
+		fn.save(path)
+		assert not [f for f in os.listdir(path) if f.endswith('.pickle')]
+		loaded = Interpolator.load(path)
+		npt.assert_almost_equal(loaded(xi, method='idw'), fn(xi, method='idw'))
+	assert loaded.anisotropy[1] is None
+
+	# directories saved in an earlier format are rejected
+	with open(os.path.join(path, 'meta.json')) as f:
+		meta = json.load(f)
+	meta['format'] = 1
+	with open(os.path.join(path, 'meta.json'), 'w') as f:
+		json.dump(meta, f)
+	npt.assert_raises(ValueError, Interpolator.load, path)
+
+def test_channel_aligned_anisotropy():
+	from smear.transform import SN_CoordinateSystem
+	points = np.random.random((100,2))*100
+	values = np.random.random(100)*100
+	xi = np.random.random((10,2))*80 + 10
+
+	# along a straight centerline the s, n transform is a rigid motion
+	coordinate_system = SN_CoordinateSystem(np.array([0., 50., 100.]), np.array([0., 0., 0.]))
+	vi_target = Interpolator(points, values, anisotropy=(0., 3.))(xi, method='idw')
+	vi = Interpolator(points, values, anisotropy=(0., 3.), coordinate_system=coordinate_system)(xi, method='idw')
+	npt.assert_almost_equal(vi, vi_target)
+
+	vi = Interpolator(points, values, anisotropy=(0., lambda s: 3.), coordinate_system=coordinate_system)(xi, method='idw')
+	npt.assert_almost_equal(vi, vi_target)
+	npt.assert_raises(ValueError, Interpolator, points, values, anisotropy=(0., lambda s: 3.))
+
+def test_crs(tmpdir):
+	lonlat = np.column_stack((np.random.random(200) - 99.5, np.random.random(200) + 29.5))
+	values = np.random.random(200)*100
+	xi = np.column_stack((np.random.random(20)*0.8 - 99.4, np.random.random(20)*0.8 + 29.6))
+	points = reproject(lonlat, 'epsg:4326', 'epsg:32614')
+	xi_utm = reproject(xi, 'epsg:4326', 'epsg:32614')
+
+	fn = Interpolator(lonlat, values, crs='epsg:32614', points_crs='epsg:4326')
+	npt.assert_almost_equal(fn.points, points)
+	for method in ('nearest', 'idw', 'linear'):
+		vi_target = Interpolator(points, values)(xi_utm, method=method)
+		npt.assert_almost_equal(fn(xi, method=method, crs='epsg:4326'), vi_target)
+		npt.assert_almost_equal(fn(xi_utm, method=method), vi_target)
+		# a single point keeps its shape
+		npt.assert_almost_equal(fn(xi[0], method=method, crs='epsg:4326'), vi_target[0])
+		assert np.shape(fn(xi[0], method=method, crs='epsg:4326')) == np.shape(fn(xi_utm[0], method=method))
+
+	fn.save(str(tmpdir.join('crs')))
+	loaded = Interpolator.load(str(tmpdir.join('crs')))
+	npt.assert_almost_equal(loaded(xi, method='idw', crs='epsg:4326'), fn(xi, method='idw', crs='epsg:4326'))
+	npt.assert_raises(ValueError, Interpolator(points, values), xi, crs='epsg:4326')
+
+def test_max_distance():
+	# two survey patches with a gap between them
+	points = np.vstack((np.random.random((200,2))*10, np.random.random((200,2))*10 + [90, 0]))
+	values = np.random.random(400)
+	xi = np.random.random((300,2))*[100, 10]
+
+	fn = Interpolator(points, values)
+	dist, ix = fn.tree.query(xi, k=6)
+	for method in ('nearest', 'idw', 'linear', 'natural'):
+		vi = fn(xi, method=method, max_distance=5.)
+		full = fn(xi, method=method)
+		gap = dist[:,0] > 5.
+		assert np.all(np.isnan(vi[gap]))
+		if method in ('nearest', 'linear', 'natural'):
+			npt.assert_almost_equal(vi[~gap], full[~gap])
+
+	# idw only uses the neighbours within max_distance
+	vi = fn(xi, method='idw', nnear=6, max_distance=1.)
+	inside = dist < 1.
+	for n in np.flatnonzero(inside[:,0] & (dist[:,0] > 1e-10)):
+		w = 1 / dist[n][inside[n]]
+		npt.assert_almost_equal(vi[n], np.sum(w * values[ix[n][inside[n]]]) / np.sum(w))
+
+	# too few neighbours
+	vi = fn(xi, method='idw', max_distance=1., min_neighbours=3)
+	npt.assert_array_equal(np.isnan(vi), dist[:,2] > 1.)
+
+	# pending updates are searched with the same bound
+	fn.add_points(np.array([[50., 5.]]), np.array([7.]))
+	npt.assert_almost_equal(fn(np.array([[50.5, 5.]]), method='idw', max_distance=1.), [7.])
+
+def test_single_precision(tmpdir):
+	# projected coordinates far from their origin
+	points = np.random.random((1000,2))*1000 + [500000, 3000000]
+	values = 10 + 3*np.sin(points[:,0]/50) + np.cos(points[:,1]/70)
+	xi = np.random.random((500,2))*1000 + [500000, 3000000]
+
+	double = Interpolator(points, values)
+	single = Interpolator(points, values, precision='single')
+	assert single.values.dtype == np.float32
+	for method, kwargs in (('nearest', {}), ('idw', {'power': 2}), ('linear', {}), ('cubic', {}), ('natural', {}),
+			('kriging', {'nnear': 12}), ('linear', {'nnear': 10, 'triangulation': 'local'})):
+		vi = single(xi, method=method, **kwargs)
+		assert vi.dtype == np.float32
+		npt.assert_allclose(vi, double(xi, method=method, **kwargs), rtol=0, atol=1e-5 * np.abs(values).max())
+
+	# and reproduce a linear field up to the float32 rounding of its values
+	linear = 2*(points[:,0] - 500000) + 3*(points[:,1] - 3000000)
+	linear_target = 2*(xi[:,0] - 500000) + 3*(xi[:,1] - 3000000)
+	fn = Interpolator(points, linear, precision='single')
+	inside = fn.triangulation.find_simplex(xi) != -1
+	for method in ('linear', 'natural'):
+		npt.assert_allclose(fn(xi[inside], method=method), linear_target[inside], rtol=0,
+				atol=1e-6 * np.abs(linear).max())
+
+	dist, ix = single._index.query(xi, k=6)
+	assert dist.dtype == np.float32 and ix.dtype == np.int32
+	assert single.operator(xi, method='idw').dtype == np.float32
+
+	# cached weights and indices take half the memory
+	cached = [Interpolator(points, values, cache_size=10**7, precision=precision) for precision in ('double', 'single')]
+	for fn in cached:
+		fn(xi, method='idw')
+	assert cached[1]._cache.info().nbytes * 2 == cached[0]._cache.info().nbytes
+
+	single.add_points(xi[:10], np.ones(10))
+	npt.assert_almost_equal(single(xi[:10], method='idw'), 1)
+	single.compact()
+	single.save(str(tmpdir.join('single')))
+	loaded = Interpolator.load(str(tmpdir.join('single')))
+	assert loaded.precision == 'single'
+	assert loaded(xi, method='idw').dtype == np.float32
@@ -0,0 +1,54 @@
+import numpy as np
+import numpy.testing as npt
+from smear.interpolate import Interpolator
+from smear.grid import grid
+from smear.io import read_npy, read_xyz, xyz_to_npy, open_raster
+
+def test_xyz_to_npy(tmpdir):
+	xyz = np.random.random((1000,3))
+	xyz.tofile(str(tmpdir.join('survey.xyz')))
+
+	points, values = read_xyz(str(tmpdir.join('survey.xyz')))
+	npt.assert_array_equal(points, xyz[:,:2])
+	npt.assert_array_equal(values, xyz[:,2])
+
+	points, values = xyz_to_npy(str(tmpdir.join('survey.xyz')), str(tmpdir.join('points.npy')),
+			str(tmpdir.join('values.npy')), chunk_size=300)
+	assert isinstance(points, np.memmap)
+	npt.assert_array_equal(points, xyz[:,:2])
+	npt.assert_array_equal(values, xyz[:,2])
+
+def test_memmap_interpolator(tmpdir):
+	points = np.random.random((1000,2))
+	values = np.random.random(1000)
+	np.save(str(tmpdir.join('points.npy')), points)
+	np.save(str(tmpdir.join('values.npy')), values)
+	xi = np.random.random((10,2))
+
+	fn = Interpolator(read_npy(str(tmpdir.join('points.npy'))), read_npy(str(tmpdir.join('values.npy'))))
+	assert np.shares_memory(fn.tree.data, fn.points)
+	npt.assert_almost_equal(fn(xi, method='idw'), Interpolator(points, values)(xi, method='idw'))
+
+	# read only inputs are not modified when the points are scaled
+	fn = Interpolator(read_npy(str(tmpdir.join('points.npy'))), read_npy(str(tmpdir.join('values.npy'))), ellipsivity=2.)
+	npt.assert_array_equal(fn.points, points)
+
+	# float32 values are memory mapped as they are in single precision
+	xyz = np.column_stack((points, values))
+	xyz.tofile(str(tmpdir.join('survey.xyz')))
+	mapped_points, mapped_values = xyz_to_npy(str(tmpdir.join('survey.xyz')), str(tmpdir.join('points32.npy')),
+			str(tmpdir.join('values32.npy')), values_dtype=np.float32)
+	assert mapped_values.dtype == np.float32
+	fn = Interpolator(mapped_points, mapped_values, precision='single')
+	assert np.shares_memory(fn.values, mapped_values)
+
+def test_grid_to_raster(tmpdir):
+	points = np.random.random((1000,2))
+	values = np.random.random(1000)
+	x = np.linspace(0, 1, 50)
+	y = np.linspace(0, 1, 30)
+
+	fn = Interpolator(points, values)
+	out = open_raster(str(tmpdir.join('raster.npy')), (30, 50))
+	grid(fn, x, y, method='idw', tile_size=16, out=out)
+	npt.assert_almost_equal(np.load(str(tmpdir.join('raster.npy'))), grid(fn, x, y, method='idw'))
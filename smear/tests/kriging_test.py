@@ -0,0 +1,87 @@
+import numpy as np
+import numpy.testing as npt
+from smear.interpolate import Interpolator
+from smear.grid import grid
+from smear.kriging import Variogram, fit_variogram
+
+def _kriging_reference(points, values, x, variogram):
+	"""solve the ordinary kriging system of a single target"""
+	k = len(points)
+	A = np.ones((k + 1, k + 1))
+	A[:k,:k] = variogram.covariance(np.linalg.norm(points[:,np.newaxis] - points[np.newaxis], axis=2))
+	A[k,k] = 0.
+	b = np.ones(k + 1)
+	b[:k] = variogram.covariance(np.linalg.norm(points - x, axis=1))
+	solution = np.linalg.solve(A, b)
+	return np.dot(solution[:k], values), variogram.nugget + variogram.sill - np.dot(solution[:k], b[:k]) - solution[k]
+
+def test_kriging(monkeypatch):
+	points = np.random.random((300,2))*100
+	values = np.sin(points[:,0]/10) + points[:,1]/50
+	xi = np.vstack((np.random.random((20,2))*100, points[:3]))
+
+	fn = Interpolator(points, values)
+	variogram = Variogram('exponential', 0.01, 1., 30.)
+	vi, variance = fn(xi, method='kriging', nnear=10, variogram=variogram, return_variance=True)
+
+	dist, ix = fn.tree.query(xi, k=10)
+	for n in range(len(xi)):
+		v, var = _kriging_reference(points[ix[n]], values[ix[n]], xi[n], variogram)
+		npt.assert_almost_equal(vi[n], v)
+		if n < 20:
+			npt.assert_almost_equal(variance[n], var)
+	npt.assert_almost_equal(vi[-3:], values[:3])
+	npt.assert_array_equal(variance[-3:], 0)
+	assert np.all(variance[:-3] > 0)
+
+	# the same weights without the variance, in blocks and as an operator
+	npt.assert_almost_equal(fn(xi, method='kriging', nnear=10, variogram=variogram, block_size=7), vi)
+	W = fn.operator(xi, method='kriging', nnear=10, variogram=variogram)
+	npt.assert_almost_equal(W @ values, vi)
+	npt.assert_almost_equal(W.sum(axis=1), 1)
+
+	# blocks are sized by the memory of their kriging systems, not by block_size alone
+	import smear.interpolate
+	from smear import kriging
+	monkeypatch.setattr(smear.interpolate, '_KRIGING_BLOCK_BYTES', 5 * 8 * 11**2 * 8)
+	sizes = []
+	def kriging_weights(neighbours, *args, **kwargs):
+		sizes.append(len(neighbours))
+		return kriging._kriging_weights(neighbours, *args, **kwargs)
+	monkeypatch.setattr(smear.interpolate, '_kriging_weights', kriging_weights)
+	npt.assert_almost_equal(fn(xi, method='kriging', nnear=10, variogram=variogram), vi)
+	npt.assert_almost_equal(fn.operator(xi, method='kriging', nnear=10, variogram=variogram) @ values, vi)
+	assert max(sizes) == 5 and sum(sizes) == 2 * len(xi)
+	monkeypatch.undo()
+
+	# targets far from the points get NaN values and variances
+	vi, variance = fn(np.array([[50., 50.], [500., 500.]]), method='kriging', max_distance=20., return_variance=True)
+	assert np.isfinite(vi[0]) and np.isfinite(variance[0])
+	assert np.isnan(vi[1]) and np.isnan(variance[1])
+
+	try:
+		fn(xi, method='idw', return_variance=True)
+		assert False
+	except ValueError:
+		pass
+
+def test_fit_variogram():
+	points = np.random.random((3000,2))*100
+	values = np.sin(points[:,0]/10) + np.cos(points[:,1]/10)
+	variogram = fit_variogram(points, values, sample_size=500)
+	assert variogram.model == 'spherical'
+	assert variogram(0.) == 0
+	h = np.linspace(1, 100, 50)
+	assert np.all(np.diff(variogram(h)) >= 0)
+	npt.assert_almost_equal(variogram.covariance(h) + variogram(h), variogram.nugget + variogram.sill)
+
+	# the interpolator fits a variogram once, grid uses the same one for every tile
+	fn = Interpolator(points, values)
+	assert fn.variogram is fn.variogram
+	x = np.linspace(0, 100, 23)
+	y = np.linspace(0, 100, 17)
+	xx, yy = np.meshgrid(x, y)
+	vi_target = fn(np.column_stack((xx.ravel(), yy.ravel())), method='kriging', nnear=8).reshape(len(y), len(x))
+	npt.assert_almost_equal(grid(fn, x, y, method='kriging', nnear=8, tile_size=8), vi_target)
+	npt.assert_almost_equal(grid(fn, x, y, method='kriging', nnear=8, tile_size=8, workers=2, executor='process'),
+			vi_target)
@@ -1,6 +1,7 @@
 import numpy as np
 import numpy.testing as npt
-from smear.path import densify_path, interpolate_duplicated_gps, _interp_between_duplicates
+from smear.path import densify_path, interpolate_duplicated_gps, _interp_between_duplicates, \
+    interpolate_duplicated_gps_chunks, densify_path_chunks, clean_track_chunks
 
 def test_densify_path():
     x = np.array([1.,2.,3.,5.,8.,9.,10.])
@@ -12,7 +13,31 @@ def test_densify_path():
     path = np.vstack((x,y)).T
     pathi = np.vstack((xi,yi)).T
     
-    npt.assert_almost_equal(pathi, densify_path(path, 1.4142))
+    npt.assert_almost_equal(pathi, densify_path(path, 1.4143))
+    # the diagonal steps of 1.41421 are split when the spacing is shorter
+    dense_path = densify_path(path, 1.4142)
+    assert len(dense_path) == 16
+    assert np.all(np.hypot(*np.diff(dense_path, axis=0).T) <= 1.4142)
+
+
+def test_densify_path_values():
+    path = np.array([[0.,0.],[0.,1.],[3.,5.],[3.,5.],[3.,6.]])
+    depth = np.array([1.,2.,7.,8.,9.])
+    values = np.column_stack((depth, 2*depth))
+
+    dense_path, dense_values = densify_path(path, 1., values)
+    npt.assert_almost_equal(dense_path, [[0.,0.],[0.,1.],[0.6,1.8],[1.2,2.6],[1.8,3.4],
+                                         [2.4,4.2],[3.,5.],[3.,5.],[3.,6.]])
+    npt.assert_almost_equal(dense_values[:,0], [1.,2.,3.,4.,5.,6.,7.,8.,9.])
+    npt.assert_almost_equal(dense_values[:,1], 2*dense_values[:,0])
+
+    # existing points are kept exactly
+    path = np.cumsum(np.random.random((1000,2)), axis=0)
+    dense_path, dense_depth = densify_path(path, 0.1, path[:,0])
+    kept = np.isin(dense_path[:,0], path[:,0])
+    npt.assert_array_equal(dense_path[kept], path)
+    npt.assert_array_equal(dense_depth, dense_path[:,0])
+    assert np.all(np.hypot(*np.diff(dense_path, axis=0).T) <= 0.1 * (1 + 1e-12))
 
 
 def test_interpolate_duplicated_gps():
@@ -32,6 +57,38 @@ def test_interpolate_duplicated_gps():
     npt.assert_almost_equal(pathi, interpolate_duplicated_gps(path), verbose=False)
 
 
+def test_interpolate_duplicated_gps_times():
+    x = np.array([0., 0., 0., 3., 3., 3., 6., 6., 6.])
+    y = np.array([0., 0., 0., 0., 0., 2., 4., 4., 4.])
+    times = np.array([0., 1., 2., 3., 6., 9., 10., 10.5, 30.])
+    path = np.column_stack((x, y))
+
+    # the y change at ping 5 is a fix for both coordinates
+    pathi, dropouts = interpolate_duplicated_gps(path, times, max_gap=5.)
+    npt.assert_almost_equal(pathi[:, 0], [0., 1., 2., 3., 3., 3., 6., 6., 6.])
+    npt.assert_almost_equal(pathi[:, 1], [0., 0., 0., 0., 1., 2., 4., 4., 4.])
+    npt.assert_array_equal(dropouts, [False, False, False, True, True, False, True, True, True])
+
+    npt.assert_almost_equal(interpolate_duplicated_gps(path, times), pathi)
+    pathi, dropouts = interpolate_duplicated_gps(path, max_gap=2)
+    npt.assert_almost_equal(pathi[:3, 0], [0., 1., 2.])
+    npt.assert_array_equal(dropouts, [True]*3 + [False]*6)
+
+    # asking for the dropouts does not change the index based interpolation
+    path = np.column_stack(([0., 0., 0., 3., 3., 3., 6.], [0., 0., 2., 2., 2., 4., 4.]))
+    pathi, dropouts = interpolate_duplicated_gps(path, max_gap=100)
+    npt.assert_almost_equal(pathi, interpolate_duplicated_gps(path))
+    npt.assert_almost_equal(pathi[:, 0], np.arange(7.))
+    assert not np.any(dropouts)
+    npt.assert_raises(ValueError, interpolate_duplicated_gps, path, times[::-1])
+
+    # evenly spaced pings with the fixes changing both coordinates match the index based version
+    fixes = np.cumsum(np.random.random((500, 2)) + 0.1, axis=0)
+    path = np.repeat(fixes, np.random.randint(1, 10, len(fixes)), axis=0)
+    npt.assert_almost_equal(interpolate_duplicated_gps(path, np.arange(len(path)) * 0.1),
+                            interpolate_duplicated_gps(path))
+
+
 def test_interp_between_duplicates():
     x = np.array([1.0,1.0,1.0,2.0,2.0,3.0,3.0,3.0,4.0,4.0,5.0,5.0,5.0,5.0,6.0,6.0])
     xi = np.array([ 1. ,  1.33333333,  1.66666667,  2.  ,  2.5,
@@ -45,4 +102,65 @@ def test_interp_between_duplicates():
                     3.        ,  3.33333333,  3.66666667,  4.        ,  3.        ,
                     2.        ,  1.5       ,  1.        ,  2.66666667,  4.33333333,  6.])
 
-    npt.assert_almost_equal(_interp_between_duplicates(x), xi) 
\ No newline at end of file
+    npt.assert_almost_equal(_interp_between_duplicates(x), xi) 
+
+def _gps_track(n):
+    # a fix every few pings, with runs of duplicates across chunk boundaries
+    fixes = np.cumsum(np.random.random((n // 5, 2)) - 0.3, axis=0)
+    path = np.repeat(fixes, np.random.randint(1, 10, len(fixes)), axis=0)[:n]
+    path[:50, 0] = path[0, 0]
+    return path
+
+
+def test_interpolate_duplicated_gps_chunks():
+    path = _gps_track(2000)
+    depth = np.random.random(len(path))
+    target = interpolate_duplicated_gps(path)
+
+    for size in (1, 7, 100, 5000):
+        chunks = [path[i:i + size] for i in range(0, len(path), size)]
+        npt.assert_array_equal(np.concatenate(list(interpolate_duplicated_gps_chunks(chunks))), target)
+
+        chunks = [(path[i:i + size], depth[i:i + size]) for i in range(0, len(path), size)]
+        out = list(interpolate_duplicated_gps_chunks(chunks))
+        npt.assert_array_equal(np.concatenate([p for p, v in out]), target)
+        npt.assert_array_equal(np.concatenate([v for p, v in out]), depth)
+
+
+def test_densify_path_chunks():
+    path = np.cumsum(np.random.random((1000, 2)), axis=0)
+    values = np.random.random((1000, 3))
+    target_path, target_values = densify_path(path, 0.3, values)
+
+    for size in (1, 7, 100, 5000):
+        chunks = [(path[i:i + size], values[i:i + size]) for i in range(0, len(path), size)]
+        out = list(densify_path_chunks(chunks, 0.3))
+        npt.assert_array_equal(np.concatenate([p for p, v in out]), target_path)
+        npt.assert_array_equal(np.concatenate([v for p, v in out]), target_values)
+
+        chunks = [path[i:i + size] for i in range(0, len(path), size)]
+        npt.assert_array_equal(np.concatenate(list(densify_path_chunks(chunks, 0.3))), target_path)
+
+
+def test_clean_track_chunks():
+    from smear.transform import SN_CoordinateSystem, reproject
+    lonlat = _gps_track(2000) * 1e-4 + [-99., 30.]
+    depth = np.random.random(len(lonlat))
+    coordinate_system = SN_CoordinateSystem(np.array([480000., 520000.]), np.array([3320000., 3330000.]))
+
+    path = reproject(interpolate_duplicated_gps(lonlat), 'epsg:4326', 'epsg:32614')
+    target_path, target_depth = densify_path(path, 2., depth)
+    target_s, target_n = coordinate_system.transform_xy_to_sn(target_path[:, 0], target_path[:, 1])
+
+    # densified in projected metres by a single pipeline
+    out = list(clean_track_chunks(((lonlat[i:i + 64], depth[i:i + 64]) for i in range(0, len(lonlat), 64)),
+                                  spacing=2., src_crs='epsg:4326', dst_crs='epsg:32614',
+                                  coordinate_system=coordinate_system))
+    sn = np.concatenate([p for p, v in out])
+    npt.assert_allclose(sn[:, 0], target_s)
+    npt.assert_allclose(sn[:, 1], target_n, atol=1e-6)
+    npt.assert_array_equal(np.concatenate([v for p, v in out]), target_depth)
+
+    # reprojecting needs both crs
+    npt.assert_raises(ValueError, clean_track_chunks, [lonlat], src_crs='epsg:4326')
+    npt.assert_raises(ValueError, clean_track_chunks, [lonlat], dst_crs='epsg:32614')
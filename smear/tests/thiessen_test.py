@@ -0,0 +1,54 @@
+import numpy as np
+import numpy.testing as npt
+from scipy.spatial import Voronoi
+import shapely
+from smear.thiessen import thiessen, clip_thiessen, thiessen_areas
+
+def test_thiessen():
+	points = np.random.random((500,2))*100
+	polygons = thiessen(points)
+	coords, offsets = thiessen(points, flat=True)
+	assert len(polygons) == len(points) == len(offsets) - 1
+
+	voronoi = Voronoi(points)
+	for n, polygon in enumerate(polygons):
+		npt.assert_array_equal(polygon, coords[offsets[n]:offsets[n+1]])
+		npt.assert_array_equal(polygon[0], polygon[-1])
+
+		# clockwise, i.e. negative signed area, and containing its point
+		x, y = polygon.T
+		assert np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]) < 0
+		edges = np.diff(polygon, axis=0)
+		to_point = points[n] - polygon[:-1]
+		assert np.all(edges[:,0] * to_point[:,1] - edges[:,1] * to_point[:,0] < 0)
+
+		# bounded cells match the scipy voronoi diagram
+		region = voronoi.regions[voronoi.point_region[n]]
+		if -1 not in region and np.all((points[n] > 10) & (points[n] < 90)):
+			npt.assert_almost_equal(np.sort(polygon[:-1], axis=0), np.sort(voronoi.vertices[region], axis=0))
+
+def test_thiessen_duplicates():
+	points = np.array([[0.,0.],[1.,0.],[0.,1.],[1.,1.],[0.5,0.5],[0.5,0.5]])
+	coords, offsets = thiessen(points, flat=True)
+	npt.assert_array_equal(np.diff(offsets) > 0, [True]*5 + [False])
+
+def test_thiessen_areas():
+	points = np.random.random((500,2))*100
+	polygons = clip_thiessen(points, (0, 0, 100, 100))
+	areas = thiessen_areas(points, (0, 0, 100, 100))
+	assert isinstance(areas, np.ndarray) and areas.shape == (500,)
+	npt.assert_almost_equal(areas, shapely.area(polygons))
+	npt.assert_almost_equal(areas.sum(), 100*100)
+	assert np.all(shapely.contains_xy(polygons, points[:,0], points[:,1]))
+
+	# clipping to a survey boundary polygon, cells outside it are empty
+	boundary = shapely.Polygon([(0, 0), (100, 0), (0, 100)])
+	areas = thiessen_areas(points, boundary)
+	npt.assert_almost_equal(areas.sum(), 100*100/2)
+	assert np.all(areas[points.sum(axis=1) < 100] > 0)
+
+	# duplicated points share the area of their cell
+	points = np.array([[0.,0.],[1.,0.],[0.,1.],[1.,1.],[0.5,0.5],[0.5,0.5]])
+	areas = thiessen_areas(points, (0, 0, 1, 1))
+	npt.assert_almost_equal(areas.sum(), 1)
+	npt.assert_almost_equal(areas[4:], [0.25, 0.25])
@@ -0,0 +1,168 @@
+import numpy as np
+import numpy.testing as npt
+from shapely.geometry import Point
+import smear.transform
+from pyproj import Transformer
+from smear.transform import SN_CoordinateSystem, projection, retrieve_projection_params, reproject
+
+def _transform_xy_to_sn_reference(coordinate_system, x, y):
+	# point by point shapely transform
+	centerline = coordinate_system.centerline
+	d = coordinate_system.slope_distance
+	s = np.zeros(x.size)
+	n = np.zeros(x.size)
+	for ii in range(x.size):
+		pt = Point((x[ii],y[ii]))
+		s[ii] = centerline.project(pt)
+		pt_s = centerline.interpolate(s[ii])
+		# shapely measures negative distances from the end of the line
+		pt_s1 = centerline.interpolate(max(s[ii] - d, 0))
+		pt_s2 = centerline.interpolate(s[ii] + d)
+		cross = (pt_s2.x - pt_s1.x) * (pt.y - pt_s.y) - (pt_s2.y - pt_s1.y) * (pt.x - pt_s.x)
+		n[ii] = -np.sign(cross) * pt_s.distance(pt)
+	return s, n
+
+def _transform_sn_to_xy_reference(coordinate_system, s, n):
+	centerline = coordinate_system.centerline
+	d = coordinate_system.slope_distance
+	x = np.zeros(s.size)
+	y = np.zeros(s.size)
+	for ii in range(s.size):
+		pt_s = centerline.interpolate(s[ii])
+		pt_s1 = centerline.interpolate(max(s[ii] - d, 0))
+		pt_s2 = centerline.interpolate(s[ii] + d)
+		unit_normal = np.array([-(pt_s2.y - pt_s1.y), pt_s2.x - pt_s1.x])
+		unit_normal /= np.sqrt(np.square(unit_normal).sum())
+		x[ii], y[ii] = np.array([pt_s.x, pt_s.y]) - unit_normal*n[ii]
+	return x, y
+
+def _meander(n):
+	t = np.linspace(0, 4 * np.pi, n)
+	return 100 * t, 150 * np.sin(t)
+
+def test_transform_xy_to_sn():
+	cx, cy = _meander(200)
+	coordinate_system = SN_CoordinateSystem(cx, cy, chunk_size=500)
+	x = np.random.random(2000) * 1300
+	y = np.random.random(2000) * 600 - 300
+
+	s, n = coordinate_system.transform_xy_to_sn(x, y)
+	s_target, n_target = _transform_xy_to_sn_reference(coordinate_system, x, y)
+	npt.assert_allclose(s, s_target, atol=1e-6)
+	npt.assert_allclose(n, n_target, atol=1e-6)
+
+def test_transform_far_points():
+	# points near the centerline and far outside the grid of cells around it
+	cx, cy = _meander(200)
+	coordinate_system = SN_CoordinateSystem(cx, cy)
+	x = np.concatenate((np.random.random(500) * 1300, np.random.random(500) * 20000 - 10000))
+	y = np.concatenate((np.random.random(500) * 100 - 50, np.random.random(500) * 20000 - 10000))
+
+	s, n = coordinate_system.transform_xy_to_sn(x, y)
+	s_target, n_target = _transform_xy_to_sn_reference(coordinate_system, x, y)
+	npt.assert_allclose(s, s_target, atol=1e-6)
+	npt.assert_allclose(n, n_target, atol=1e-6)
+
+def test_transform_uneven_segments():
+	# a few long segments between many short ones
+	cx = np.concatenate(([-1000.], np.linspace(0, 10, 100), [1000.]))
+	cy = np.concatenate(([0.], np.random.random(100), [50.]))
+	coordinate_system = SN_CoordinateSystem(cx, cy)
+	x = np.random.random(500) * 2400 - 1200
+	y = np.random.random(500) * 400 - 200
+
+	s, n = coordinate_system.transform_xy_to_sn(x, y)
+	s_target, n_target = _transform_xy_to_sn_reference(coordinate_system, x, y)
+	npt.assert_allclose(s, s_target, atol=1e-6)
+	npt.assert_allclose(n, n_target, atol=1e-6)
+
+def test_transform_sn_to_xy():
+	cx, cy = _meander(200)
+	coordinate_system = SN_CoordinateSystem(cx, cy)
+	s = np.random.random(1000) * coordinate_system.centerline.length
+	n = np.random.random(1000) * 20 - 10
+
+	x, y = coordinate_system.transform_sn_to_xy(s, n)
+	x_target, y_target = _transform_sn_to_xy_reference(coordinate_system, s, n)
+	npt.assert_allclose(x, x_target, atol=1e-6)
+	npt.assert_allclose(y, y_target, atol=1e-6)
+
+def test_transform_xy_to_sn_chunks(tmpdir, monkeypatch):
+	cx, cy = _meander(200)
+	coordinate_system = SN_CoordinateSystem(cx, cy, chunk_size=300)
+	xy = np.random.random((2000,2)) * [1300, 600] - [0, 300]
+	s_target, n_target = coordinate_system.transform_xy_to_sn(xy[:,0], xy[:,1])
+
+	# memory mapped input, in a process pool
+	np.save(str(tmpdir.join('xy.npy')), xy)
+	xy_mmap = np.load(str(tmpdir.join('xy.npy')), mmap_mode='r')
+	chunks = list(coordinate_system.transform_xy_to_sn_chunks(xy_mmap, workers=2))
+	assert len(chunks) == 7
+	npt.assert_array_equal(np.concatenate([s for s, n in chunks]), s_target)
+	npt.assert_array_equal(np.concatenate([n for s, n in chunks]), n_target)
+
+	# an iterator of uneven chunks
+	chunks = coordinate_system.transform_xy_to_sn_chunks(iter(np.array_split(xy, [10, 1500])), workers=2)
+	npt.assert_array_equal(np.concatenate([s for s, n in chunks]), s_target)
+
+	# in this process by default
+	monkeypatch.setattr(smear.transform, 'ProcessPoolExecutor', None)
+	chunks = list(coordinate_system.transform_xy_to_sn_chunks(xy_mmap))
+	npt.assert_array_equal(np.concatenate([s for s, n in chunks]), s_target)
+	monkeypatch.undo()
+
+	out = (np.zeros(2000), np.zeros(2000))
+	s, n = coordinate_system.transform_xy_to_sn(xy[:,0], xy[:,1], workers=2, out=out)
+	assert s is out[0]
+	npt.assert_array_equal(s, s_target)
+	npt.assert_array_equal(n, n_target)
+
+class _Response:
+	status_code = 200
+	reason = 'OK'
+	text = '+proj=longlat +ellps=WGS84 +no_defs'
+
+def _offline_lookup(monkeypatch, tmpdir):
+	def get(url, **kwargs):
+		raise AssertionError("unexpected request to %s" % url)
+	monkeypatch.setattr(smear.transform.requests, 'get', get)
+	monkeypatch.setenv('SMEAR_CACHE_DIR', str(tmpdir))
+	retrieve_projection_params.cache_clear()
+	projection.cache_clear()
+
+def test_projection_offline(monkeypatch, tmpdir):
+	_offline_lookup(monkeypatch, tmpdir)
+	assert '+proj=lcc' in retrieve_projection_params('esri:102737')
+	assert 'PROJCS' in retrieve_projection_params('EPSG:32614', format='ogcwkt')
+	assert projection('epsg:4326') is projection('epsg:4326')
+	npt.assert_almost_equal(projection('epsg:32614')(-99., 0.), (500000., 0.), decimal=3)
+
+def test_projection_disk_cache(monkeypatch, tmpdir):
+	_offline_lookup(monkeypatch, tmpdir)
+	npt.assert_raises(ValueError, retrieve_projection_params, 'sr-org:6', network=False)
+
+	calls = []
+	def get(url, **kwargs):
+		calls.append(url)
+		return _Response()
+	monkeypatch.setattr(smear.transform.requests, 'get', get)
+	assert retrieve_projection_params('sr-org:6') == _Response.text
+	assert calls == ['http://spatialreference.org/ref/sr-org/6/proj4/']
+
+	# the next process finds the definition on disk
+	retrieve_projection_params.cache_clear()
+	assert retrieve_projection_params('sr-org:6', network=False) == _Response.text
+	assert len(calls) == 1
+
+def test_reproject():
+	lonlat = np.column_stack((np.random.random(1000) - 99.5, np.random.random(1000) + 29.5))
+	x, y = Transformer.from_crs('epsg:4326', 'epsg:32614', always_xy=True).transform(lonlat[:,0], lonlat[:,1])
+
+	xy = reproject(lonlat, 'epsg:4326', 'epsg:32614', chunk_size=300)
+	npt.assert_allclose(xy, np.column_stack((x, y)))
+
+	# in place
+	out = lonlat.copy()
+	assert reproject(out, 'epsg:4326', 'epsg:32614', out=out) is out
+	npt.assert_allclose(out, xy)
+	npt.assert_allclose(reproject(out, 'epsg:32614', 'epsg:4326'), lonlat)
@@ -3,15 +3,24 @@ module for computing thiessen polygons
 """
 import numpy as np
 from scipy.spatial import Delaunay
+import shapely
 
+from .instrument import instrumented
 
-def thiessen(points, bounds_scale=5):
+
+@instrumented('thiessen.thiessen')
+def thiessen(points, bounds_scale=5, flat=False):
     """Return list of thiessen polygons for given 2d numpy array of
     points. ``bounds_scale`` is basically a measure of how far out the
     bounding thiessen polygons will be created. If it's too large, set
     it smaller; if it's too small make it bigger. For most
     applications, you'll want to clip the polygons yourself at some
     point so making them too big isn't a problem.
+
+    Each polygon is a closed (k + 1, 2) array of its vertices in clockwise
+    order. With ``flat=True`` a tuple ``(coords, offsets)`` is returned
+    instead, where polygon ``i`` is ``coords[offsets[i]:offsets[i + 1]]``;
+    this avoids creating a python object per polygon for large point sets.
     """
     # something that is way bigger than the points
     x_scale, y_scale = (points.min(axis=0) - points.max(axis=0)) * bounds_scale
@@ -26,14 +35,81 @@ def thiessen(points, bounds_scale=5):
 
     outer_box = means + scale_offsets
 
+    n = len(points)
     points = np.vstack([points, outer_box])
     tri = Delaunay(points)
-    circumcenters = np.array([_circumcenter(tri.points[t])
-                              for t in tri.vertices])
-    thiessen_polys = [_thiessen_poly(tri, circumcenters, n)
-                      for n in range(len(points) - 4)]
+    simplices = tri.simplices
+    circumcenters = _circumcenters(points[simplices])
+
+    # the triangles around each vertex, grouped by vertex (a CSR vertex to
+    # simplex index) and sorted clockwise by the direction of their
+    # centroids, which lie within the angle the triangle spans at the vertex
+    vertex = simplices.ravel()
+    simplex = np.repeat(np.arange(len(simplices)), 3)
+    keep = vertex < n
+    vertex, simplex = vertex[keep], simplex[keep]
+    corners = points[simplices]
+    centroids = (corners[:, 0] + corners[:, 1] + corners[:, 2]) / 3
+    direction = centroids[simplex] - points[vertex]
+    order = np.argsort(-np.arctan2(direction[:, 1], direction[:, 0]))
+    order = order[np.argsort(vertex[order], kind='stable')]
+    simplex = simplex[order]
+
+    # close every polygon by repeating its first vertex, points dropped
+    # from the triangulation as duplicates get empty polygons
+    counts = np.bincount(vertex, minlength=n)
+    starts = np.cumsum(counts) - counts
+    closed = counts + (counts > 0)
+    offsets = np.concatenate(([0], np.cumsum(closed)))
+    polygon = np.repeat(np.arange(n), closed)
+    position = np.arange(offsets[-1]) - offsets[polygon]
+    coords = circumcenters[simplex[starts[polygon] + position % counts[polygon]]]
+
+    if flat:
+        return coords, offsets
+
+    return np.split(coords, offsets[1:-1])
+
+
+@instrumented('thiessen.clip_thiessen')
+def clip_thiessen(points, boundary, bounds_scale=5):
+    """Return the thiessen polygons of ``points`` clipped to ``boundary``,
+    either a ``(xmin, ymin, xmax, ymax)`` bounding box or a shapely
+    geometry such as a survey boundary polygon, as a numpy array of shapely
+    geometries. Clipping is done for all polygons at once with the
+    vectorized shapely operations. Polygons outside the boundary, and those
+    of points dropped as duplicates, are empty.
+    """
+    coords, offsets = thiessen(points, bounds_scale, flat=True)
+    polygons = np.full(len(points), shapely.Polygon(), dtype=object)
+    nonempty = np.flatnonzero(np.diff(offsets))
+    rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(nonempty)), np.diff(offsets)[nonempty]))
+    polygons[nonempty] = shapely.polygons(rings)
+
+    if isinstance(boundary, shapely.Geometry):
+        shapely.prepare(boundary)
+        return shapely.intersection(polygons, boundary)
+
+    return shapely.clip_by_rect(polygons, *boundary)
+
+
+@instrumented('thiessen.thiessen_areas')
+def thiessen_areas(points, boundary, bounds_scale=5):
+    """Return the (n,) areas of the thiessen polygons of ``points`` clipped
+    to ``boundary`` (see ``clip_thiessen``). Duplicated points share the
+    area of their polygon equally.
+
+    The areas are the declustering weights of the points: pass them as
+    ``weights`` to ``Interpolator`` idw interpolation so that densely
+    sampled areas, e.g. overlapping survey lines, do not dominate.
+    """
+    areas = shapely.area(clip_thiessen(points, boundary, bounds_scale))
+    unique, inverse, counts = np.unique(points, axis=0, return_inverse=True, return_counts=True)
+    if len(unique) == len(points):
+        return areas
 
-    return thiessen_polys
+    inverse = inverse.ravel()
+    return (np.bincount(inverse, weights=areas) / counts)[inverse]
 
 
 def plot_thiessen(points, bounds_scale=10):
@@ -51,109 +127,23 @@ def plot_thiessen(points, bounds_scale=10):
 #---------------------------------------------------------------------------
 # internal functions
 #---------------------------------------------------------------------------
-def _any_equal(arr, n):
-    """for a given Mx3 array, returns a 1xM array containing indices
-    of rows where any of the columns are equal to n.
-    """
-    return np.where((arr[:, 0] == n) | (arr[:, 1] == n) | (arr[:, 2] == n))[0]
-
+def _circumcenters(vertices):
+    """returns the (m, 2) circumcenters of triangles.
 
-def _circumcenter(vertices):
-    """returns the circumcenter of a triangle.
-
-    ``vertices`` should be a np.array of size (3,2) containing the
-    points of the triangle
+    ``vertices`` should be a np.array of size (m, 3, 2) containing the
+    points of the triangles
     """
-    ax, ay, bx, by, cx, cy = vertices.flatten()
+    ax, ay, bx, by, cx, cy = vertices.reshape((-1, 6)).T
 
     D = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
 
     # don't divide by 0
-    if D == 0:
-        D = 0.000000001
-
-    ux = ((ax**2 + ay**2) * (by - cy) + (bx**2 + by**2) * (cy - ay) + (cx**2 + cy**2) * (ay - by)) / D
-    uy = ((ax**2 + ay**2) * (cx - bx) + (bx**2 + by**2) * (ax - cx) + (cx**2 + cy**2) * (bx - ax)) / D
-
-    return ux, uy
-
-
-def _find_triangles_for_vertex(tri, n):
-    """returns all of the indices of the triangles for the nth vertex
-    of a given a scipy.spatial.Delaunay object
-    """
-    # grab the list of triangles that touch this vertex
-    triangles = tri.vertices[_any_equal(tri.vertices, n)]
+    D[D == 0] = 0.000000001
 
-    # we want to sort the triangles so that neighbors are together,
-    # just start with the first triangle
-    sorted_triangles = [triangles[0]]
+    a2 = ax**2 + ay**2
+    b2 = bx**2 + by**2
+    c2 = cx**2 + cy**2
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / D
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / D
 
-    # initialize values
-    if triangles[0][0] != n:
-        previous_vertex_idx = triangles[0][0]
-    else:
-        previous_vertex_idx = triangles[0][1]
-
-    # just stash the common vertex for checking if we're sorted
-    # clockwise later on
-    common_edge_vertex_idx = previous_vertex_idx
-
-    # loop through the triangles; previous_vertex_index will be the
-    # index to the vertex we used in the previous triangle
-    for i in triangles[1:]:
-        this_triangle = sorted_triangles[-1]
-
-        # find the vertex of the triangle that is not the central
-        # vertex and is not shared with the previous triangle
-        next_vertex_idx = this_triangle[(this_triangle != n) & (this_triangle != previous_vertex_idx)]
-
-        # append the next triangle (note: match will return both the
-        # previous triangle and the next triangle, since they both
-        # contain the shared vertex)
-        matching_triangles = triangles[_any_equal(triangles, next_vertex_idx)]
-        if np.all(this_triangle == matching_triangles[0]):
-            sorted_triangles.append(matching_triangles[1])
-        else:
-            sorted_triangles.append(matching_triangles[0])
-
-        previous_vertex_idx = next_vertex_idx
-
-    sorted_triangle_indices = [
-        int(np.where(np.all(tri.vertices[:] == triangle, axis=1))[0])
-        for triangle in sorted_triangles]
-
-    # if we're sorted counter-clockwise, then we need to reverse order
-    test_point = tri.points[triangles[0][(triangles[0] != n) & (triangles[0] != common_edge_vertex_idx)]].flatten()
-    if not _is_right(tri.points[n], tri.points[common_edge_vertex_idx], test_point):
-        return sorted_triangle_indices[::-1]
-
-    # otherwise we're good
-    return sorted_triangle_indices
-
-
-def _is_right(a, b, p):
-    """given a line (defined by points a and b) and a point (p),
-    return true if p is to the right of the line and false otherwise
-
-    raises a ValueError if p lies is colinear with a and b
-    """
-    ax, ay = a[0], a[1]
-    bx, by = b[0], b[1]
-    px, py = p[0], p[1]
-    value = (bx - ax) * (py - ay) - (by - ay) * (px - ax)
-
-    if value == 0:
-        raise ValueError(
-            "p is colinear with a and b, 'tis neither right nor left.")
-
-    return value < 0
-
-
-def _thiessen_poly(tri, circumcenters, n):
-    """given a Delaunay triangulation object, calculates a thiessen
-    polygon for the vertex index n
-    """
-    triangles = _find_triangles_for_vertex(tri, n)
-    triangles = np.hstack((triangles, triangles[0]))
-    return [circumcenters[t] for t in triangles]
+    return np.column_stack((ux, uy))
@@ -1,35 +1,127 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing.shared_memory import SharedMemory
+import os
+import warnings
+
 import numpy as np
-from pyproj import Proj
+from pyproj import CRS, Proj, Transformer
+from pyproj.exceptions import CRSError
 import requests
-from shapely.geometry import LineString, Point
+from scipy.interpolate import splprep, splev
+from scipy.spatial import cKDTree as KDTree
+from shapely.geometry import LineString
+
+from .instrument import instrumented
+
+
+@lru_cache(maxsize=None)
+def projection(srs_code, network=True):
+    """returns a cached ``pyproj.Proj`` for the SRS code, e.g. 'epsg:4326'
+    or 'esri:102737', see ``retrieve_projection_params`` for the lookup"""
+    crs = _local_crs(srs_code)
+    if crs is not None:
+        return Proj(crs)
+
+    return Proj(retrieve_projection_params(srs_code, network=network))
 
 
-def projection(srs_code):
-    return Proj(retrieve_projection_params(srs_code))
+@lru_cache(maxsize=None)
+def retrieve_projection_params(srs_code, format='proj4', network=True):
+    """returns the definition of the SRS code in the given spatialreference.org
+    format ('proj4', 'ogcwkt', 'esriwkt' or 'prettywkt' are also available
+    offline).
 
+    The code is looked up, in order, in the pyproj CRS database, in the
+    on-disk cache (``$SMEAR_CACHE_DIR/projections``, by default
+    ``~/.cache/smear/projections``) and, if ``network`` is True, on
+    spatialreference.org, whose answers are written to the on-disk cache.
+    Results are memoized for the life of the process.
+    """
+    crs = _local_crs(srs_code)
+    if crs is not None and format in _CRS_FORMATS:
+        with warnings.catch_warnings():
+            # proj4 strings are what this function has always returned
+            warnings.simplefilter('ignore', UserWarning)
+            return _CRS_FORMATS[format](crs)
+
+    path = os.path.join(_projection_cache_dir(), '%s.%s' % (srs_code.lower().strip().replace(':', '_'),
+                                                            format.strip()))
+    if os.path.exists(path):
+        with open(path) as f:
+            return f.read()
+
+    if not network:
+        raise ValueError('Unable to find projection details for %s in format %s in the pyproj database or in %s'
+                         % (srs_code, format, _projection_cache_dir()))
 
-def retrieve_projection_params(srs_code, format='proj4'):
     #http://spatialreference.org/ref/esri/102737/proj4/
 
     base_url = 'http://spatialreference.org/ref/'
     tags = srs_code.lower().strip().split(':') + [format.strip() + '/']
     url = base_url + '/'.join(tags)
-    r = requests.get(url)
+    try:
+        r = requests.get(url, timeout=10)
+    except requests.RequestException as e:
+        raise ValueError('Unable to retrieve projection details for %s in format %s from \
+            spatialreference.org, error message received: %s' % (srs_code, format, e))
 
     if r.status_code == 200:
+        _write_projection_cache(path, r.text)
         return r.text
     else:
         raise ValueError('Unable to retrieve projection details for %s in format %s from \
             spatialreference.org, error message received: %s - %s' % (srs_code, format, r.status_code, r.reason))
 
 
+@lru_cache(maxsize=None)
+def transformer(src_crs, dst_crs):
+    """returns a cached ``pyproj.Transformer`` from ``src_crs`` to
+    ``dst_crs``, taking and returning x, y (i.e. lon, lat) order. A crs is
+    anything ``pyproj.CRS.from_user_input`` accepts or an SRS code looked
+    up like ``retrieve_projection_params``."""
+    return Transformer.from_crs(_crs(src_crs), _crs(dst_crs), always_xy=True)
+
+
+@instrumented('transform.reproject')
+def reproject(xy, src_crs, dst_crs, out=None, chunk_size=65536):
+    """Reproject the (m, 2) points ``xy`` from ``src_crs`` to ``dst_crs``
+    ``chunk_size`` points at a time, with a cached ``transformer`` working
+    in place on each chunk.
+
+    The result is written into ``out``, which may be ``xy`` itself to
+    reproject without any full copy of the points, and otherwise is a new
+    float64 array. ``xy`` may be a read only memmap.
+    """
+    transform = transformer(src_crs, dst_crs)
+    if out is None:
+        out = np.empty(np.shape(xy))
+    elif np.shape(out) != np.shape(xy):
+        raise ValueError("Found out array with shape %s. Expected shape %s" % (str(np.shape(out)), str(np.shape(xy))))
+
+    for start in range(0, len(xy), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        x = np.array(xy[chunk, 0], dtype=float)
+        y = np.array(xy[chunk, 1], dtype=float)
+        transform.transform(x, y, inplace=True)
+        out[chunk, 0] = x
+        out[chunk, 1] = y
+
+    return out
+
+
 class SN_CoordinateSystem:
     """ 
     Define an SN Coordinate System based on a given centerline
     Convert xy dataset into sn Coordinate System based on a given centerline.
+
+    The centerline is stored as arrays of segments with their cumulative arc
+    length and a KD-tree over short pieces of the segments, so both
+    transforms run as batched numpy operations over all points.
     """
 
-    def __init__(self, cx, cy, slope_distance=0.01, interp=None, interp_params=[]):
+    def __init__(self, cx, cy, slope_distance=0.01, interp=None, interp_params=[], chunk_size=65536):
         """
         Initialize SN coordinate system. Requires arrays containing cartesian x,y values 
         and arrays containing centerline cx,cy cartesian coordinates 
@@ -40,6 +132,11 @@ class SN_CoordinateSystem:
 
         self.centerline = LineString(zip(cx.tolist(), cy.tolist()))
         self.slope_distance = slope_distance
+        self.chunk_size = chunk_size
+
+        self._vertices = np.column_stack((cx, cy)).astype(float)
+        self._arc_length = np.concatenate(([0.], np.cumsum(np.hypot(*np.diff(self._vertices, axis=0).T))))
+        self._build_segment_index()
 
     def norm(self, x):
         return np.sqrt(np.square(x).sum())
@@ -70,44 +167,380 @@ class SN_CoordinateSystem:
             ynew = np.concatenate((ynew,ytmp))
 
         return (xnew, ynew)
-                         
-    def transform_xy_to_sn(self, x, y):
-        s = np.zeros(x.size)
-        n = np.zeros(x.size)
-        v = np.zeros((x.size,2))
-        vn = np.zeros((x.size,2))
-        for ii in range(x.size):
-            pt = Point((x[ii],y[ii]))
-            s[ii] = self.centerline.project(pt)
-            pt_s = self.centerline.interpolate(s[ii])
-            pt_s1 = self.centerline.interpolate(s[ii] - self.slope_distance)
-            pt_s2 = self.centerline.interpolate(s[ii] + self.slope_distance)
-            vn[ii,0] = pt.x - pt_s.x
-            vn[ii,1] = pt.y - pt_s.y
-            v[ii,0] = pt_s2.x - pt_s1.x
-            v[ii,1] = pt_s2.y - pt_s1.y
-            n[ii] = pt_s.distance(pt)
-
-        n = -np.sign(np.cross(v,vn)) * n
+
+    def interpolate_xy(self, s):
+        """returns the x, y coordinates of the centerline at arc lengths ``s``,
+        clamped to the ends of the centerline like ``LineString.interpolate``"""
+        s = np.asarray(s, dtype=float)
+        segment = self._segment(s)
+        foot = self._vertices[segment] + (np.clip(s, 0, self._arc_length[-1]) - self._arc_length[segment])[..., np.newaxis] * self._unit[segment]
+        return foot[..., 0], foot[..., 1]
+
+    def tangent(self, s):
+        """returns the (unnormalized) tangent of the centerline at arc
+        lengths ``s``, the chord between the centerline points
+        ``slope_distance`` before and after ``s``. Beyond the ends of the
+        centerline the tangent at the end is returned."""
+        s = np.clip(np.asarray(s, dtype=float), 0, self._arc_length[-1])
+        return self._tangent(s, self._segment(s))
+
+    def project(self, x, y):
+        """returns the arc length of the point of the centerline closest to
+        each of the points ``x``, ``y`` and the distance to it"""
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        s = np.empty(x.size)
+        dist = np.empty(x.size)
+        for start in range(0, x.size, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            s[chunk], dist[chunk] = self._project(np.column_stack((x[chunk], y[chunk])))[:2]
+
+        return s, dist
+
+    @instrumented('transform.xy_to_sn', arg=1)
+    def transform_xy_to_sn(self, x, y, workers=1, out=None):
+        """returns the (s, n) coordinates of the points ``x``, ``y``,
+        ``chunk_size`` points at a time. ``workers`` > 1 transforms the
+        chunks in a process pool (see ``transform_xy_to_sn_chunks``), -1
+        uses all cores. ``out`` is an optional tuple of (s, n) arrays, e.g.
+        memmaps, to write the result into."""
+        x = np.asarray(x).ravel()
+        y = np.asarray(y).ravel()
+        if out is None:
+            out = (np.empty(x.size), np.empty(x.size))
+        elif any(np.shape(a) != x.shape for a in out):
+            raise ValueError("Found out arrays with shapes %s. Expected shape %s"
+                             % (str([np.shape(a) for a in out]), str(x.shape)))
+
+        s, n = out
+        chunks = (np.column_stack((x[start:start + self.chunk_size], y[start:start + self.chunk_size]))
+                  for start in range(0, x.size, self.chunk_size))
+        start = 0
+        for s_chunk, n_chunk in self.transform_xy_to_sn_chunks(chunks, workers):
+            s[start:start + len(s_chunk)] = s_chunk
+            n[start:start + len(n_chunk)] = n_chunk
+            start += len(s_chunk)
+
         return (s,n)
 
+    def transform_xy_to_sn_chunks(self, xy, workers=1):
+        """Transform a stream of points, yielding an (s, n) tuple for each
+        chunk in the order of the input.
+
+        ``xy`` is either an (m, 2) array, e.g. a memory mapped .npy file
+        (see ``smear.io.read_npy``), which is read ``chunk_size`` points at a
+        time, or an iterable of (k, 2) arrays. By default the chunks are
+        transformed in this process. With ``workers`` > 1 they are
+        transformed in a process pool, -1 uses all cores. The centerline
+        arrays are placed in shared memory once rather than pickled to each
+        worker, and at most two chunks per worker are in flight, so memory
+        use does not depend on the number of points. The result does not
+        depend on the number of workers.
+        """
+        if hasattr(xy, 'shape'):
+            chunks = (xy[start:start + self.chunk_size] for start in range(0, len(xy), self.chunk_size))
+        else:
+            chunks = xy
+
+        if workers == -1:
+            workers = os.cpu_count()
+
+        if workers == 1:
+            for chunk in chunks:
+                yield self._xy_to_sn(np.asarray(chunk, dtype=float))
+            return
+
+        blocks, spec = self._share()
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach_coordinate_system, initargs=(spec,)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(_transform_chunk, np.asarray(chunk, dtype=float)))
+                    if len(pending) >= 2 * workers:
+                        yield pending.popleft().result()
+
+                while pending:
+                    yield pending.popleft().result()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    @instrumented('transform.sn_to_xy', arg=1)
     def transform_sn_to_xy(self,s,n):
-        x = np.zeros(s.size)
-        y = np.zeros(s.size)
-        unit_normal = np.zeros(2)
-        xy = np.zeros(2)
-        for ii in range(s.size):
-            pt_s = self.centerline.interpolate(s[ii])
-            xy[0] = pt_s.x
-            xy[1] = pt_s.y
-            pt_s1 = self.centerline.interpolate(s[ii] - self.slope_distance)
-            pt_s2 = self.centerline.interpolate(s[ii] + self.slope_distance)
-            unit_normal[0] = -(pt_s2.y - pt_s1.y)
-            unit_normal[1] = (pt_s2.x - pt_s1.x)
-            unit_normal = unit_normal/self.norm(unit_normal)
-            x[ii], y[ii] = xy - unit_normal*n[ii]
-            #theta = np.arctan((pt_s2.x - pt_s1.x)/(pt_s2.y - pt_s1.y))
-            #x[ii] = pt_s.x - n[ii]*np.cos(theta)
-            #y[ii] = pt_s.y + n[ii]*np.sin(theta)
-            
+        s = np.asarray(s, dtype=float).ravel()
+        n = np.asarray(n, dtype=float).ravel()
+        xs, ys = self.interpolate_xy(s)
+        vx, vy = self.tangent(s)
+        length = np.hypot(vx, vy)
+
+        x = xs + vy / length * n
+        y = ys - vx / length * n
         return (x,y)
+
+    def _xy_to_sn(self, xy):
+        """``transform_xy_to_sn`` of a single (k, 2) chunk of points"""
+        s, dist, segment, foot = self._project(xy)
+        vx, vy = self._tangent(s, segment)
+        n = -np.sign(vx * (xy[:, 1] - foot[:, 1]) - vy * (xy[:, 0] - foot[:, 0])) * dist
+        return s, n
+
+    def _share(self):
+        """copy the arrays used by ``_xy_to_sn`` into shared memory blocks,
+        returns the blocks and the spec passed to ``_attach_coordinate_system``"""
+        blocks = []
+        arrays = {}
+        for name in _SHARED_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            arrays[name] = (block.name, array.shape, array.dtype.str)
+
+        attributes = {'slope_distance': self.slope_distance, 'chunk_size': self.chunk_size,
+                      '_max_half_length': self._max_half_length, '_cell_size': self._cell_size}
+        return blocks, {'arrays': arrays, 'attributes': attributes}
+
+    def _segment(self, s):
+        """returns the index of the centerline segment containing each arc length ``s``"""
+        return np.clip(np.searchsorted(self._arc_length, s, side='right') - 1, 0, len(self._unit) - 1)
+
+    def _tangent(self, s, segment):
+        """``tangent`` for arc lengths ``s`` on the given segments. The
+        chord is parallel to the segment unless it crosses a vertex."""
+        d = self.slope_distance
+        vx = 2 * d * self._unit[segment, 0]
+        vy = 2 * d * self._unit[segment, 1]
+        across = (s - d < self._arc_length[segment]) | (s + d > self._arc_length[segment + 1])
+        if across.any():
+            x1, y1 = self.interpolate_xy(s[across] - d)
+            x2, y2 = self.interpolate_xy(s[across] + d)
+            vx[across] = x2 - x1
+            vy[across] = y2 - y1
+
+        return vx, vy
+
+    @instrumented('transform.build_segment_index')
+    def _build_segment_index(self):
+        """split the centerline segments into pieces no longer than the
+        median segment length and index the piece midpoints in a KD-tree.
+        A piece is at least its midpoint distance minus half its length
+        away, which bounds the search in ``_project``."""
+        start = self._vertices[:-1]
+        delta = np.diff(self._vertices, axis=0)
+        length = np.diff(self._arc_length)
+        if not len(length):
+            raise ValueError("A centerline needs at least two points")
+        self._unit = delta / np.maximum(length, np.finfo(float).tiny)[:, np.newaxis]
+
+        piece_length = max(np.median(length), length.max() / 1000)
+        if piece_length == 0:
+            piece_length = 1.
+        pieces = np.maximum(np.ceil(length / piece_length), 1).astype(int)
+        segment = np.repeat(np.arange(len(length)), pieces)
+        offset = np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0 = offset / pieces[segment]
+        t1 = (offset + 1) / pieces[segment]
+
+        # pieces as separate contiguous arrays of start, unit direction and length
+        piece_start = start[segment] + t0[:, np.newaxis] * delta[segment]
+        piece_delta = (t1 - t0)[:, np.newaxis] * delta[segment]
+        self._piece_length = (t1 - t0) * length[segment]
+        unit = piece_delta / np.maximum(self._piece_length, np.finfo(float).tiny)[:, np.newaxis]
+        self._piece_x, self._piece_y = piece_start.T.copy()
+        self._piece_ux, self._piece_uy = unit.T.copy()
+        self._piece_s = self._arc_length[segment] + t0 * length[segment]
+        self._piece_segment = segment
+        self._max_half_length = self._piece_length.max() / 2
+        self._piece_mid = piece_start + piece_delta / 2
+        self._piece_tree = KDTree(self._piece_mid)
+        self._build_cell_index()
+
+    def _build_cell_index(self):
+        """cover the centerline with a grid of cells holding the pieces
+        closest to the cell center. A point is resolved from the pieces of
+        its cell without a KD-tree query unless an unlisted piece could be
+        closer, i.e. the listed ones are bounded like in ``_project``."""
+        n_pieces = len(self._piece_length)
+        k = min(_CELL_PIECES, n_pieces)
+        lower = self._piece_mid.min(axis=0)
+        extent = self._piece_mid.max(axis=0) - lower
+        margin = extent.max() / 16 + self._max_half_length
+        lower = lower - margin
+        extent = extent + 2 * margin
+        cell_count = min(_MAX_CELLS, _CELLS_PER_PIECE * n_pieces)
+        cell_size = max(np.sqrt(extent[0] * extent[1] / cell_count), self._piece_length.max() / 2,
+                        np.finfo(float).tiny)
+        shape = np.ceil(extent / cell_size).astype(int)
+
+        centers = lower + (np.indices(shape).reshape(2, -1).T + 0.5) * cell_size
+        mid_dist, ix = self._piece_tree.query(centers, k=k)
+        self._cell_pieces = ix.reshape((len(centers), k)).astype(np.int32)
+        if k == n_pieces:
+            self._cell_bound = np.full(len(centers), np.inf)
+        else:
+            self._cell_bound = mid_dist[:, -1] - self._max_half_length
+        self._cell_lower = lower
+        self._cell_size = cell_size
+        self._cell_shape = shape
+
+    def _project(self, xy):
+        """vectorized ``LineString.project`` of the (m, 2) points ``xy``,
+        returns the arc lengths, distances, segment indices and coordinates
+        of the closest points"""
+        s = np.empty(len(xy))
+        dist = np.empty(len(xy))
+        segment = np.empty(len(xy), dtype=int)
+        foot = np.empty((len(xy), 2))
+        result = (s, dist, segment, foot)
+
+        # the pieces listed for the cell of each point, a point that is off
+        # the cell center by offset misses no closer piece if it is within
+        # the cell bound minus the offset
+        cell = np.floor((xy - self._cell_lower) / self._cell_size).astype(int)
+        inside = np.all((cell >= 0) & (cell < self._cell_shape), axis=1)
+        flat = np.where(inside, cell[:, 0] * self._cell_shape[1] + cell[:, 1], 0)
+        center = self._cell_lower + (cell + 0.5) * self._cell_size
+        offset = np.hypot(xy[:, 0] - center[:, 0], xy[:, 1] - center[:, 1])
+        todo = np.arange(len(xy))
+        best = self._closest(xy, todo, self._cell_pieces[flat], result)
+        todo = todo[~(inside & (best <= self._cell_bound[flat] - offset))]
+
+        n_pieces = len(self._piece_length)
+        k = min(_CELL_PIECES, n_pieces)
+        while len(todo):
+            mid_dist, ix = self._piece_tree.query(xy[todo], k=k)
+            mid_dist = mid_dist.reshape((len(todo), k))
+            best = self._closest(xy, todo, ix.reshape((len(todo), k)), result)
+
+            # a piece that was not queried lies at least this far away
+            done = (k == n_pieces) | (best <= mid_dist[:, -1] - self._max_half_length)
+            todo = todo[~done]
+            k = min(2 * k, n_pieces)
+
+        return result
+
+    def _closest(self, xy, todo, ix, result):
+        """find the closest of the candidate pieces ``ix`` (len(todo), c) for the
+        points ``xy[todo]``, store it in the ``_project`` result arrays and
+        return its distance"""
+        s, dist, segment, foot = result
+
+        # squared distance to the closest point of each candidate piece
+        ux = self._piece_ux[ix]
+        uy = self._piece_uy[ix]
+        rx = xy[todo, 0, np.newaxis] - self._piece_x[ix]
+        ry = xy[todo, 1, np.newaxis] - self._piece_y[ix]
+        t = rx * ux
+        t += ry * uy
+        np.clip(t, 0, self._piece_length[ix], out=t)
+        rx -= t * ux
+        ry -= t * uy
+        rx *= rx
+        ry *= ry
+        rx += ry
+
+        rows = np.arange(len(todo))
+        order = np.argmin(rx, axis=1)
+        piece = ix[rows, order]
+        best = np.sqrt(rx[rows, order])
+        t = t[rows, order]
+        s[todo] = self._piece_s[piece] + t
+        dist[todo] = best
+        segment[todo] = self._piece_segment[piece]
+        foot[todo, 0] = self._piece_x[piece] + t * self._piece_ux[piece]
+        foot[todo, 1] = self._piece_y[piece] + t * self._piece_uy[piece]
+        return best
+
+
+#---------------------------------------------------------------------------
+# internal functions
+#---------------------------------------------------------------------------
+_CRS_FORMATS = {
+    'proj4': lambda crs: crs.to_proj4(),
+    'ogcwkt': lambda crs: crs.to_wkt('WKT1_GDAL'),
+    'esriwkt': lambda crs: crs.to_wkt('WKT1_ESRI'),
+    'prettywkt': lambda crs: crs.to_wkt('WKT1_GDAL', pretty=True),
+}
+
+
+def _crs(crs):
+    """returns the ``pyproj.CRS`` for a crs given to ``transformer``"""
+    if not isinstance(crs, str):
+        return CRS.from_user_input(crs)
+
+    local = _local_crs(crs)
+    if local is not None:
+        return local
+
+    return CRS.from_user_input(retrieve_projection_params(crs))
+
+
+def _local_crs(srs_code):
+    """returns the ``pyproj.CRS`` of the SRS code from the pyproj database or None"""
+    try:
+        return CRS.from_user_input(srs_code.strip())
+    except CRSError:
+        return None
+
+
+def _projection_cache_dir():
+    cache_dir = os.environ.get('SMEAR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'smear'))
+    return os.path.join(cache_dir, 'projections')
+
+
+def _write_projection_cache(path, text):
+    """atomically write a retrieved definition to the on-disk cache,
+    failing silently since the cache is only an optimization"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+_SHARED_ARRAYS = ('_vertices', '_arc_length', '_unit', '_piece_x', '_piece_y', '_piece_ux', '_piece_uy',
+                  '_piece_length', '_piece_s', '_piece_segment', '_piece_mid', '_cell_pieces', '_cell_bound',
+                  '_cell_lower', '_cell_shape')
+# pieces listed per cell of the grid in ``_build_cell_index``, and its size
+_CELL_PIECES = 8
+_CELLS_PER_PIECE = 64
+_MAX_CELLS = 2**16
+_worker_coordinate_system = None
+_worker_blocks = None
+
+
+def _attach_coordinate_system(spec):
+    """process pool initializer building an ``SN_CoordinateSystem`` on the
+    shared memory blocks described by ``spec`` (see ``_share``). Only the
+    forward transform is available on it."""
+    global _worker_coordinate_system, _worker_blocks
+    coordinate_system = SN_CoordinateSystem.__new__(SN_CoordinateSystem)
+    coordinate_system.centerline = None
+    _worker_blocks = []
+    for name, (block_name, shape, dtype) in spec['arrays'].items():
+        block = _attach_shared_memory(block_name)
+        _worker_blocks.append(block)
+        setattr(coordinate_system, name, np.ndarray(shape, dtype, buffer=block.buf))
+
+    coordinate_system.__dict__.update(spec['attributes'])
+    coordinate_system._piece_tree = KDTree(coordinate_system._piece_mid)
+    _worker_coordinate_system = coordinate_system
+
+
+def _attach_shared_memory(name):
+    """attach to an existing shared memory block, the creating process unlinks it"""
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:
+        # python < 3.13 always registers the block, pool workers share the
+        # resource tracker of the creating process so this is a no-op
+        return SharedMemory(name)
+
+
+def _transform_chunk(xy):
+    """transform one chunk of points in a worker process"""
+    return _worker_coordinate_system._xy_to_sn(xy)